@@ -0,0 +1,229 @@
+# benchmarks.py
+"""
+benchmarks.py - End-to-end measurement latency benchmarks.
+
+Times each stage of the measurement hot path against simulated sweeps of
+increasing length (1e2 .. 1e6 points by default):
+
+    acquire      pstat_driver.run_cv_blocking on a pstat_sim device
+    movavg       sensor_pipeline.movavg
+    analyze      sensor_pipeline.concentration_from_cv
+    batch        sensor_pipeline.concentration_from_cv_batch (n sweeps of 300 points)
+    calibrate    Calibrator.apply (per call, n calls)
+    cal_array    Calibrator.apply_array (one call, n currents)
+    plot         CreatinineGraph.update_graph        (needs Kivy)
+    history      HistoryLogScreen.load_history       (needs Kivy, n readings)
+
+Usage (from CreatConnect/):
+    python benchmarks.py                       # run, compare with bench_baseline.json
+    python benchmarks.py --save-baseline       # run and store as the new baseline
+    python benchmarks.py --json out.json --sizes 100 10000
+
+Results are written as JSON ({"meta": ..., "results": {"stage@n": seconds}}).
+meta["reference_s"] is the time of a fixed numpy + Python workload; baselines
+are rescaled by it, so bench_baseline.json (committed) stays usable on other
+machines and under CPU frequency drift. Exit status is 1 when any stage is
+slower than baseline * (1 + tolerance) by more than MIN_REGRESSION_S; with --ci
+a missing baseline is an error too.
+"""
+import argparse, json, os, platform, sys, time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "bench_baseline.json")
+CALIBRATION_FILE = os.path.join(HERE, "calibration.json")
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+DEFAULT_TOLERANCE = 0.25
+MIN_TIME_S = 0.2       # repeat a stage until this much time has been spent
+MIN_REGRESSION_S = 100e-6   # slowdowns smaller than this are timer noise
+MAX_REPEATS = 50
+
+# stages that do per-item Python/widget work are capped so a run stays short
+STAGE_MAX_N = {"batch": 10000, "calibrate": 100000, "plot": 100000, "history": 10000}
+
+def sweep_params(n):
+    """Cyclic params yielding ~n samples at 1 ms sampling; long runs add cycles
+    rather than slowing the scan, so the peak height stays realistic."""
+    period = min(int(n), 1000)
+    return {"quietValue": 0.0, "quietTime": 0, "amplitude": 0.4, "offset": 0.0,
+            "period": period, "numCycles": max(1, int(n) // period), "shift": 0.0}
+
+def simulated_sweep(n, seed=0):
+    from pstat_sim import cv_curve
+    t, V, I = cv_curve(sweep_params(n), sample_period_ms=1, concentration_mg_dL=1.0,
+                       rng=np.random.default_rng(seed))
+    return t * 1e-3, V, I
+
+def time_call(fn):
+    """Best-of-N wall time of fn() in seconds."""
+    best, spent, reps = float("inf"), 0.0, 0
+    while reps < MAX_REPEATS and (reps < 3 or spent < MIN_TIME_S):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best, spent, reps = min(best, dt), spent + dt, reps + 1
+    return best
+
+def reference_time():
+    """Time of a fixed mix of numpy and interpreter work, the machine-speed yardstick."""
+    x = np.random.default_rng(0).normal(size=200000)
+    def work():
+        np.cumsum(x)
+        np.sort(x)
+        sum(i * i for i in range(20000))
+    return time_call(work)
+
+# --- stages: each takes n and returns a zero-arg callable to time ---
+def stage_acquire(n):
+    from pstat_driver import run_cv_blocking
+    from pstat_sim import simulator_factory
+    factory = simulator_factory(time_scale=0.0, seed=0)
+    return lambda: run_cv_blocking("sim://1", sweep_params(n), sample_period_ms=1,
+                                   show_progress=False, factory=factory)
+
+def stage_movavg(n):
+    from sensor_pipeline import movavg
+    _, _, I = simulated_sweep(n)
+    return lambda: movavg(I, k=5)
+
+def stage_analyze(n):
+    from sensor_pipeline import concentration_from_cv
+    from calibration import Calibrator
+    _, V, I = simulated_sweep(n)
+    cal = Calibrator(CALIBRATION_FILE)
+    return lambda: concentration_from_cv(V, I, cal, smooth_k=5, peak="reduction")
+
+def stage_batch(n):
+    from sensor_pipeline import concentration_from_cv_batch
+    from calibration import Calibrator
+    _, V, I = simulated_sweep(300)
+    rng = np.random.default_rng(1)
+    I_batch = I[None, :] + rng.normal(0.0, 0.05, (n, I.size))
+    V_batch = np.broadcast_to(V, I_batch.shape)
+    cal = Calibrator(CALIBRATION_FILE)
+    return lambda: concentration_from_cv_batch(V_batch, I_batch, cal, smooth_k=5, peak="reduction")
+
+def stage_calibrate(n):
+    from calibration import Calibrator
+    cal = Calibrator(CALIBRATION_FILE)
+    currents = np.linspace(-90.0, -2.0, n).tolist()
+    return lambda: [cal.apply(x) for x in currents]
+
+def stage_cal_array(n):
+    from calibration import Calibrator
+    cal = Calibrator(CALIBRATION_FILE)
+    currents = np.linspace(-90.0, -2.0, n)
+    return lambda: cal.apply_array(currents)
+
+def stage_plot(n):
+    from graph import CreatinineGraph
+    _, V, I = simulated_sweep(n)
+    widget = CreatinineGraph()
+    V_list, I_list = V.tolist(), I.tolist()
+    return lambda: widget.update_graph(V_list, I_list)
+
+def stage_history(n):
+    import tempfile
+    import data_storage, history_log_screen
+    # n readings in a throwaway database, used as the shared store
+    store = data_storage.ReadingsStore(os.path.join(tempfile.mkdtemp(), "readings.db"))
+    conc = np.round(np.linspace(0.4, 2.5, n), 2)
+    store.add_many({"ts": 1.7e9 + 300.0 * i, "conc_mg_dL": c} for i, c in enumerate(conc))
+    store.flush()
+    data_storage.set_store(store)
+    screen = history_log_screen.HistoryLogScreen()
+    return screen.load_history
+
+STAGES = {
+    "acquire": stage_acquire,
+    "movavg": stage_movavg,
+    "analyze": stage_analyze,
+    "batch": stage_batch,
+    "calibrate": stage_calibrate,
+    "cal_array": stage_cal_array,
+    "plot": stage_plot,
+    "history": stage_history,
+}
+
+def run(stages, sizes, verbose=True):
+    results, skipped = {}, {}
+    for name in stages:
+        for n in sizes:
+            if n > STAGE_MAX_N.get(name, n):
+                continue
+            key = f"{name}@{n}"
+            try:
+                fn = STAGES[name](n)
+            except ImportError as e:
+                skipped[name] = str(e)
+                if verbose:
+                    print(f"{name:<10} skipped ({e})")
+                break
+            results[key] = time_call(fn)
+            if verbose:
+                print(f"{key:<18} {results[key] * 1e3:10.3f} ms")
+    return results, skipped
+
+def compare(results, baseline, tolerance, scale=1.0):
+    """Return [(key, now, before, ratio)] for stages slower than baseline*scale*(1+tolerance)."""
+    regressions = []
+    for key, now in results.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        before *= scale
+        if now > before * (1.0 + tolerance) and now - before > MIN_REGRESSION_S:
+            regressions.append((key, now, before, now / before))
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    ap.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--ci", action="store_true", help="fail when there is no baseline to compare with")
+    args = ap.parse_args(argv)
+
+    reference = reference_time()
+    results, skipped = run(args.stages, args.sizes)
+    reference = min(reference, reference_time())     # before and after: drift shows up as the slower one
+    report = {
+        "meta": {"time": time.time(), "python": platform.python_version(),
+                 "numpy": np.__version__, "machine": platform.platform(),
+                 "reference_s": reference, "skipped": skipped},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.")
+        return 2 if args.ci else 0
+    with open(args.baseline, "r") as f:
+        saved = json.load(f)
+    baseline = saved.get("results", {})
+    base_ref = saved.get("meta", {}).get("reference_s")
+    scale = reference / base_ref if base_ref else 1.0
+    if args.ci and not set(results) & set(baseline):
+        print(f"Baseline {args.baseline} has none of the measured stages.")
+        return 2
+    print(f"Machine speed vs baseline: {1.0 / scale:.2f}x")
+    regressions = compare(results, baseline, args.tolerance, scale)
+    for key, now, before, ratio in regressions:
+        print(f"REGRESSION {key}: {now * 1e3:.3f} ms vs {before * 1e3:.3f} ms ({ratio:.2f}x)")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
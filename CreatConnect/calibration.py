@@ -1,13 +1,24 @@
 # calibration.py
-import json, numpy as np
+import hashlib, json, os, threading
+from collections import OrderedDict
+import numpy as np
 from units import mM_to_mg_dL, mg_dL_to_mM
 
+DEFAULT_CALIBRATION = "calibration.json"
+MAX_CACHED_CALIBRATIONS = 8
+
 class Calibrator:
-    def __init__(self, path="calibration.json", target_unit=None):
-        with open(path, "r") as f:
-            cfg = json.load(f)
+    """Read-only once built; get_calibration() hands out shared instances."""
+    def __init__(self, path=DEFAULT_CALIBRATION, target_unit=None, cfg=None, digest=None):
+        if cfg is None:
+            with open(path, "rb") as f:
+                raw = f.read()
+            cfg = json.loads(raw)
+            digest = hashlib.sha256(raw).hexdigest()
+        self.path = path
+        self.digest = digest                               # sha256 of the source file
         self.kind = (cfg.get("type") or "linear").lower()
-        self.coeffs = cfg.get("coeffs", [])
+        self.coeffs = tuple(cfg.get("coeffs", []))
         self.x_unit = cfg.get("x_unit", "uA")
         self.y_unit = cfg.get("y_unit", "mM")             # model output unit
         self.target_unit = (target_unit or
@@ -22,6 +33,62 @@ class Calibrator:
         self.x_offset = float(cfg.get("x_offset_uA", 0.0))
         self.min_abs = float(cfg.get("min_abs_uA", 1e-6))
 
+        # model and unit conversion are resolved once here, not on every apply
+        self._model = self._compile_model()
+        # unit conversions are pure scale factors, so convert 1.0 once
+        self._unit_factor = self._convert_units(1.0, self.y_unit, self.target_unit)
+        self._frozen = True
+
+    @classmethod
+    def from_config(cls, cfg, target_unit=None):
+        """Build from an already-parsed calibration dict (e.g. an archived to_config())."""
+        return cls(path=None, target_unit=target_unit, cfg=cfg)
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("Calibrator is read-only; load a new one instead")
+        super().__setattr__(name, value)
+
+    def _compile_model(self):
+        """y = f(x) for this calibration kind; works on floats and numpy arrays."""
+        try:
+            if self.kind == "linear":
+                b0, b1 = self._get_coeffs(2)
+                return lambda x: b0 + b1 * x
+            if self.kind == "polynomial":
+                coeffs = [float(c) for c in reversed(self.coeffs)]   # np.polyval wants highest-first
+                return lambda x: np.polyval(coeffs, x)
+            if self.kind == "inverse":
+                if len(self.coeffs) == 1:
+                    b0, k = 0.0, float(self.coeffs[0])
+                else:
+                    b0, k = float(self.coeffs[0]), float(self.coeffs[1])
+                x0 = self.x_offset
+                return lambda x: b0 + k / (x - x0)
+            raise ValueError(f"Unknown calibration type: {self.kind}")
+        except ValueError as e:
+            # bad configs keep failing at apply time, as before
+            msg = str(e)
+            def broken(x):
+                raise ValueError(msg)
+            return broken
+
+    def to_config(self) -> dict:
+        """The settings this calibrator was built from, in calibration.json form."""
+        return {
+            "type": self.kind,
+            "coeffs": list(self.coeffs),
+            "x_unit": self.x_unit,
+            "y_unit": self.y_unit,
+            "target_unit": self.target_unit,
+            "decimals": self.decimals,
+            "mw_g_per_mol": self.mw,
+            "valid_range_uA": [self.valid_lo, self.valid_hi],
+            "use_abs_current": self.use_abs,
+            "x_offset_uA": self.x_offset,
+            "min_abs_uA": self.min_abs,
+        }
+
     def apply(self, current_uA: float) -> float:
         # sanity/window check
         if not (self.valid_lo <= current_uA <= self.valid_hi):
@@ -31,36 +98,34 @@ class Calibrator:
         if self.use_abs:
             x = abs(x)
 
-        if self.kind == "linear":
-            # y = b0 + b1*x
-            b0, b1 = self._get_coeffs(2)
-            y = b0 + b1 * x
-
-        elif self.kind == "polynomial":
-            # y = b0 + b1*x + b2*x^2 + ...
-            # coeffs in JSON are [b0,b1,...]; np.polyval wants highest-first
-            y = float(np.polyval(list(reversed(self.coeffs)), x))
-
-        elif self.kind == "inverse":
-            # y = b0 + k / (x - x0)
-            # coeffs: [b0, k]  (if only one provided, interpret as [0, k])
-            if len(self.coeffs) == 1:
-                b0, k = 0.0, float(self.coeffs[0])
-            else:
-                b0, k = float(self.coeffs[0]), float(self.coeffs[1])
-
-            denom = x - self.x_offset
-            if abs(denom) < self.min_abs:
-                raise ValueError(f"Current too close to zero for inverse model (|I - {self.x_offset}| < {self.min_abs} µA)")
-            y = b0 + k / denom
-
-        else:
-            raise ValueError(f"Unknown calibration type: {self.kind}")
+        # inverse: y = b0 + k / (x - x0), undefined near x0
+        if self.kind == "inverse" and abs(x - self.x_offset) < self.min_abs:
+            raise ValueError(f"Current too close to zero for inverse model (|I - {self.x_offset}| < {self.min_abs} µA)")
+        y = float(self._model(x))
 
         # unit conversion (model y_unit -> desired target_unit)
-        y_conv = self._convert_units(y, self.y_unit, self.target_unit)
+        y_conv = y * self._unit_factor
         return float(round(y_conv, self.decimals))
 
+    def apply_array(self, current_uA):
+        """
+        Vectorised apply. Returns (values, bad): values is a float array in the
+        target unit, NaN wherever apply() would raise (outside valid_range, NaN
+        input, too close to x0 for the inverse model); bad is that boolean mask.
+        A broken calibration config still raises ValueError.
+        """
+        x = np.asarray(current_uA, dtype=float)
+        bad = ~((x >= self.valid_lo) & (x <= self.valid_hi))    # also catches NaN
+        if self.use_abs:
+            x = np.abs(x)
+        if self.kind == "inverse":
+            bad |= np.abs(x - self.x_offset) < self.min_abs
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y = np.asarray(self._model(np.where(bad, np.nan, x)), dtype=float) * self._unit_factor
+        y = np.round(y, self.decimals)
+        y[bad] = np.nan
+        return y, bad
+
     def _get_coeffs(self, n):
         if len(self.coeffs) < n:
             raise ValueError(f"{self.kind} requires {n} coeffs, got {len(self.coeffs)}")
@@ -82,4 +147,70 @@ class Calibrator:
         return val
 
 
+class CalibrationRegistry:
+    """
+    Shared, hot-reloading cache of Calibrators.
+
+    Each file is parsed once and cached under (path, mtime, size, target unit);
+    get() re-stats the file and reloads it only if it changed on disk (a touch
+    without a content change keeps the same instance, by sha256). Names can be
+    mapped to files, e.g. one calibration per sensor lot, and at most
+    max_entries calibrations are kept, least recently used dropped first.
+    """
+    def __init__(self, max_entries=MAX_CACHED_CALIBRATIONS):
+        self.max_entries = int(max_entries)
+        self._names = {}                 # name -> path
+        self._cache = OrderedDict()      # (abspath, target_unit) -> (stat_key, Calibrator)
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        """Make get(name) load `path`."""
+        with self._lock:
+            self._names[name] = path
+
+    def names(self):
+        with self._lock:
+            return dict(self._names)
+
+    def get(self, name=DEFAULT_CALIBRATION, target_unit=None) -> Calibrator:
+        with self._lock:
+            path = self._names.get(name, name)
+        key = (os.path.abspath(path), target_unit)
+        st = os.stat(path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == stat_key:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if cached is not None and cached[1].digest == digest:
+            cal = cached[1]              # touched, not edited
+        else:
+            cal = Calibrator(path, target_unit=target_unit, cfg=json.loads(raw), digest=digest)
+        with self._lock:
+            self._cache[key] = (stat_key, cal)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return cal
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_registry = None
+
+def get_registry() -> CalibrationRegistry:
+    global _registry
+    if _registry is None:
+        _registry = CalibrationRegistry()
+    return _registry
 
+def get_calibration(name=DEFAULT_CALIBRATION, target_unit=None) -> Calibrator:
+    """Shared Calibrator for a registered name or a file path, reloaded if the file changed."""
+    return get_registry().get(name, target_unit)
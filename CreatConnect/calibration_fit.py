@@ -0,0 +1,261 @@
+# calibration_fit.py
+"""
+calibration_fit.py - Fit calibration.json from standard sweeps.
+
+Each standard is a CV sweep of a known concentration (CSV with voltage and
+current columns, like simulated_data/*_Creatinine_*mgdL.csv; the concentration
+is read from the file name or given as path=conc). Peaks are extracted with
+sensor_pipeline.analyze_cv and the app's settings (--aggregate mean: the
+cathodic peaks of every cycle averaged), so the calibration is fitted on the
+feature it is applied to. Every Calibrator kind is fitted by linear least squares:
+
+    linear       y = b0 + b1*x
+    polynomial   y = b0 + b1*x + ... + bd*x^d
+    inverse      y = b0 + k/(x - x0)     (x0 fixed, or grid-searched with --fit-offset)
+
+A model needs more standards than parameters (dof > 0); --kind best picks
+the highest adjusted R^2, so extra parameters have to earn their keep.
+
+The written file keeps the unit / range settings of the existing calibration,
+gets an incremented "version" plus fit statistics, and a copy is kept in
+calibration_history/ next to it. Calibrators pick the new file up without a restart.
+
+Usage (from CreatConnect/):
+    python calibration_fit.py simulated_data/*_Creatinine_*mgdL.csv
+    python calibration_fit.py std/*.csv --kind inverse --write
+    python calibration_fit.py a.csv=0.4 b.csv=1.0 c.csv=2.5 --kind polynomial --degree 2 --write
+"""
+import argparse, datetime, json, os, re, sys
+import numpy as np
+from sensor_pipeline import analyze_cv
+from calibration import DEFAULT_CALIBRATION
+from units import mM_to_mg_dL, mg_dL_to_mM, CREATININE_MW_G_PER_MOL
+
+KINDS = ("linear", "polynomial", "inverse")
+AGGREGATES = ("mean", "median", "last", "none")
+APP_AGGREGATE = "mean"          # what user_interface.start_pstat_cv measures with
+HISTORY_DIR = "calibration_history"
+_CONC_IN_NAME = re.compile(r"([0-9]+(?:\.[0-9]+)?)\s*mg_?dl", re.IGNORECASE)
+_MM = ("mm", "mmol/l", "mmol", "mmol_l")
+
+def parse_standard(arg):
+    """'path=conc' or a path whose name contains e.g. '1.00mgdL' -> (path, conc_mg_dL)."""
+    path, sep, conc = arg.partition("=")
+    if sep:
+        return path, float(conc)
+    m = _CONC_IN_NAME.search(os.path.basename(path))
+    if not m:
+        raise ValueError(f"No concentration in file name {path}; pass it as {path}=<mg/dL>")
+    return path, float(m.group(1))
+
+def load_sweep(path):
+    """(V, I_uA) from a two-column CSV with a header row."""
+    data = np.loadtxt(path, delimiter=",", skiprows=1, encoding="utf-8", ndmin=2)
+    return data[:, 0], data[:, 1]
+
+def extract_peaks(standards, smooth_k=5, peak="reduction", smooth=None, aggregate=APP_AGGREGATE):
+    """
+    standards: [(path, conc_mg_dL)] -> (Ip_uA array, conc_mg_dL array).
+    aggregate as in analyze_cv ('none' / None: one peak over the whole trace).
+    """
+    aggregate = None if aggregate in (None, "none") else aggregate
+    Ip, conc = [], []
+    for path, c in standards:
+        V, I = load_sweep(path)
+        a = analyze_cv(V, I, None, smooth_k=smooth_k, peak=peak, smooth=smooth, aggregate=aggregate)
+        if a["peak_idx"] is None:
+            raise ValueError(f"{path} has no data")
+        Ip.append(a["Ip_uA"])
+        conc.append(c)
+    return np.array(Ip), np.array(conc)
+
+def _to_model_unit(conc_mg_dL, y_unit, mw):
+    unit = (y_unit or "").lower()
+    if unit in _MM:
+        return conc_mg_dL * mg_dL_to_mM(1.0, mw)
+    return conc_mg_dL
+
+def _from_model_unit(y, y_unit, mw):
+    unit = (y_unit or "").lower()
+    if unit in _MM:
+        return y * mM_to_mg_dL(1.0, mw)
+    return y
+
+def _stats(y, y_hat, n_params):
+    resid = y - y_hat
+    sse = float(resid @ resid)
+    sst = float(((y - y.mean()) ** 2).sum())
+    dof = int(y.size - n_params)
+    r2 = 1.0 - sse / sst if sst > 0 else float("nan")
+    return {
+        "residuals": resid.tolist(),
+        "rmse": float(np.sqrt(sse / y.size)),
+        "r2": r2,
+        # penalises parameters, so models of different size can be compared
+        "adj_r2": 1.0 - (1.0 - r2) * (y.size - 1) / dof if dof > 0 else float("nan"),
+        "dof": dof,
+    }
+
+def fit_linear(x, y):
+    A = np.column_stack([np.ones_like(x), x])
+    coeffs, *_ = np.linalg.lstsq(A, y, rcond=None)
+    return coeffs.tolist(), A @ coeffs
+
+def fit_polynomial(x, y, degree=2):
+    A = np.vander(x, degree + 1, increasing=True)
+    coeffs, *_ = np.linalg.lstsq(A, y, rcond=None)
+    return coeffs.tolist(), A @ coeffs
+
+def fit_inverse(x, y, x0=0.0, fit_offset=False, min_abs=1e-6, grid=2001):
+    """
+    y = b0 + k/(x - x0). With fit_offset, x0 is chosen from a grid below / above
+    all peak currents (one closed-form regression per candidate, all at once).
+    Returns (coeffs [b0, k], y_hat, x0).
+    """
+    if fit_offset:
+        span = max(float(np.ptp(x)), 1.0)
+        below = np.linspace(x.min() - 20 * span, x.min() - min_abs, grid // 2)
+        above = np.linspace(x.max() + min_abs, x.max() + 20 * span, grid // 2)
+        cand = np.concatenate([below, above, [float(x0)]])
+    else:
+        cand = np.array([float(x0)])
+    d = x[None, :] - cand[:, None]
+    ok = np.all(np.abs(d) >= min_abs, axis=1)
+    if not ok.any():
+        raise ValueError("A standard's peak current is within min_abs of x0")
+    cand, z = cand[ok], 1.0 / d[ok]
+    # simple regression of y on z, one row per candidate x0
+    zm, ym = z.mean(axis=1, keepdims=True), y.mean()
+    szz = ((z - zm) ** 2).sum(axis=1)
+    k = ((z - zm) * (y - ym)).sum(axis=1) / np.where(szz > 0, szz, np.nan)
+    b0 = ym - k * zm[:, 0]
+    sse = (((b0[:, None] + k[:, None] * z) - y) ** 2).sum(axis=1)
+    best = int(np.nanargmin(sse))
+    y_hat = b0[best] + k[best] * z[best]
+    return [float(b0[best]), float(k[best])], y_hat, float(cand[best])
+
+def fit(Ip_uA, conc_mg_dL, kind, base=None, degree=2, fit_offset=False):
+    """
+    Fit one calibration kind. base is an existing calibration dict whose unit,
+    range and inverse options are kept. Returns (config dict, stats dict);
+    stats residuals are in mg/dL.
+    """
+    cfg = dict(base or {})
+    for key in ("version", "fit", "fitted_at"):
+        cfg.pop(key, None)
+    mw = float(cfg.get("mw_g_per_mol", CREATININE_MW_G_PER_MOL))
+    y_unit = cfg.setdefault("y_unit", "mM")
+    cfg.setdefault("target_unit", "mg/dL")
+    x = np.asarray(Ip_uA, dtype=float)
+    if cfg.get("use_abs_current", False):
+        x = np.abs(x)
+    y = _to_model_unit(np.asarray(conc_mg_dL, dtype=float), y_unit, mw)
+
+    if kind == "linear":
+        coeffs, y_hat = fit_linear(x, y)
+        n_params = 2
+    elif kind == "polynomial":
+        coeffs, y_hat = fit_polynomial(x, y, degree)
+        n_params = degree + 1
+    elif kind == "inverse":
+        coeffs, y_hat, x0 = fit_inverse(x, y, float(cfg.get("x_offset_uA", 0.0)), fit_offset,
+                                        float(cfg.get("min_abs_uA", 1e-6)))
+        cfg["x_offset_uA"] = x0
+        n_params = 3 if fit_offset else 2
+    else:
+        raise ValueError(f"Unknown calibration type: {kind}")
+
+    if y.size <= n_params:
+        # an exact (or underdetermined) fit says nothing about the calibration
+        raise ValueError(f"{kind} has {n_params} parameters and needs at least "
+                         f"{n_params + 1} standards, got {y.size}")
+    cfg["type"] = kind
+    cfg["coeffs"] = [float(c) for c in coeffs]
+    stats = _stats(_from_model_unit(y, y_unit, mw), _from_model_unit(y_hat, y_unit, mw), n_params)
+    return cfg, stats
+
+def write_calibration(cfg, stats, standards, Ip_uA, path=DEFAULT_CALIBRATION, history_dir=None):
+    """Write cfg with the next version number (atomic replace) and keep a copy in history_dir."""
+    if history_dir is None:
+        history_dir = os.path.join(os.path.dirname(os.path.abspath(path)), HISTORY_DIR)
+    version = 0
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                version = int(json.load(f).get("version", 0))
+        except (ValueError, TypeError):
+            version = 0
+    out = dict(cfg)
+    out["version"] = version + 1
+    out["fitted_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    out["fit"] = {
+        "r2": stats["r2"], "adj_r2": stats["adj_r2"], "dof": stats["dof"], "rmse_mg_dL": stats["rmse"],
+        "standards": [{"file": os.path.basename(p), "conc_mg_dL": c, "Ip_uA": float(ip), "residual_mg_dL": r}
+                      for (p, c), ip, r in zip(standards, Ip_uA, stats["residuals"])],
+    }
+    text = json.dumps(out, indent=2)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    os.makedirs(history_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with open(os.path.join(history_dir, f"{stem}_v{out['version']}.json"), "w") as f:
+        f.write(text)
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fit calibration.json from standard CV sweeps.")
+    ap.add_argument("standards", nargs="+", help="CSV files (conc in name) or path=conc_mg_dL")
+    ap.add_argument("--kind", choices=KINDS + ("best",), default="best",
+                    help="model to write; 'best' picks the highest adjusted R^2 (default)")
+    ap.add_argument("--degree", type=int, default=2, help="polynomial degree")
+    ap.add_argument("--fit-offset", action="store_true", help="also fit x0 of the inverse model")
+    ap.add_argument("--peak", choices=("reduction", "oxidation", "abs"), default="reduction")
+    ap.add_argument("--smooth-k", type=int, default=5)
+    ap.add_argument("--aggregate", choices=AGGREGATES, default=APP_AGGREGATE,
+                    help="combine per-cycle peaks like the app does (default); 'none': whole-trace peak")
+    ap.add_argument("--base", default=DEFAULT_CALIBRATION, help="calibration whose settings are kept")
+    ap.add_argument("--out", default=DEFAULT_CALIBRATION)
+    ap.add_argument("--write", action="store_true", help="write the fitted calibration")
+    args = ap.parse_args(argv)
+
+    try:
+        standards = [parse_standard(s) for s in args.standards]
+        Ip, conc = extract_peaks(standards, args.smooth_k, args.peak, aggregate=args.aggregate)
+    except (OSError, ValueError) as e:
+        print("Error:", e)
+        return 2
+    base = {}
+    if os.path.exists(args.base):
+        with open(args.base, "r") as f:
+            base = json.load(f)
+
+    for (path, c), ip in zip(standards, Ip):
+        print(f"{os.path.basename(path):<40} {c:8.3f} mg/dL   Ip = {ip:9.4f} uA")
+    kinds = KINDS if args.kind == "best" else (args.kind,)
+    results = {}
+    for kind in kinds:
+        try:
+            results[kind] = fit(Ip, conc, kind, base, args.degree, args.fit_offset)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            print(f"{kind:<11} fit failed: {e}")
+            continue
+        cfg, stats = results[kind]
+        resid = ", ".join(f"{r:+.3f}" for r in stats["residuals"])
+        print(f"{kind:<11} coeffs={np.round(cfg['coeffs'], 6).tolist()}  "
+              f"R^2={stats['r2']:.4f}  adj R^2={stats['adj_r2']:.4f}  RMSE={stats['rmse']:.4f} mg/dL  residuals=[{resid}]")
+    if not results:
+        return 1
+
+    kind = max(results, key=lambda k: np.nan_to_num(results[k][1]["adj_r2"], nan=-np.inf))
+    if args.write:
+        cfg, stats = results[kind]
+        out = write_calibration(cfg, stats, standards, Ip, args.out)
+        print(f"Wrote {kind} calibration v{out['version']} to {args.out}")
+    else:
+        print(f"Best: {kind} (use --write to save)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
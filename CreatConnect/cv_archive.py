@@ -0,0 +1,160 @@
+# cv_archive.py
+"""
+cv_archive.py - Append-only archive of raw CV sweeps.
+
+Every run's t / V / I arrays are appended to one binary file; index.jsonl
+holds one line per run with its byte offset, length and metadata (device,
+params, calibration, result). Runs are stored either as three contiguous
+little-endian float32 columns, read back as np.memmap views, or (COMPRESS,
+the default) as a sweep_codec blob ~10x smaller, decoded on read within the
+codec's max errors. Both kinds can sit in one archive; any run is read by its
+offset alone.
+
+    cv_archive/
+        runs.f32      [t0..tn-1 | V0..Vn-1 | I0..In-1] [blob, 4-byte padded] ...
+        index.jsonl   {"run_id": 0, "offset": 0, "n": 300, ...}
+                      {"run_id": 1, "offset": 3600, "n": 300, "codec": "swc1", "nbytes": 612, ...}
+"""
+import json, os, threading, time
+import numpy as np
+from sweep_codec import encode_sweep, decode_sweep
+
+ARCHIVE_DIR = "cv_archive"
+DATA_FILE = "runs.f32"
+INDEX_FILE = "index.jsonl"
+DTYPE = np.dtype("<f4")
+N_COLUMNS = 3      # t (s), V (V), I (µA)
+CODEC = "swc1"
+COMPRESS = True    # store new runs as sweep_codec blobs
+
+class CvArchive:
+    def __init__(self, root=ARCHIVE_DIR, compress=COMPRESS):
+        self.root = root
+        self.compress = compress
+        self.data_path = os.path.join(root, DATA_FILE)
+        self.index_path = os.path.join(root, INDEX_FILE)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+        self._mm = None            # memmap over the whole data file, grown lazily
+
+    def _load_index(self):
+        entries = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break      # torn last line from an interrupted write
+        return entries
+
+    def _end_offset(self):
+        if not self._index:
+            return 0
+        last = self._index[-1]
+        return last["offset"] + last.get("nbytes", N_COLUMNS * last["n"] * DTYPE.itemsize)
+
+    def _encode(self, t, V, I_uA):
+        """(bytes, n, index fields) for one run in this archive's storage format."""
+        if self.compress:
+            blob = encode_sweep(t, V, I_uA)
+            blob += b"\0" * (-len(blob) % DTYPE.itemsize)      # keep later float32 runs aligned
+            return blob, np.asarray(t).size, {"codec": CODEC, "nbytes": len(blob)}
+        cols = np.vstack([np.asarray(t, dtype=DTYPE).ravel(),
+                          np.asarray(V, dtype=DTYPE).ravel(),
+                          np.asarray(I_uA, dtype=DTYPE).ravel()])
+        return cols.tobytes(), int(cols.shape[1]), {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self, t, V, I_uA, meta=None) -> int:
+        """Store one run and return its run_id. meta must be JSON-serialisable."""
+        data, n, fields = self._encode(t, V, I_uA)
+        entry = dict(meta or {})
+        with self._lock:
+            offset = self._end_offset()
+            # data first, then the index line: an interrupted append leaves
+            # unindexed bytes that the next append simply overwrites
+            mode = "r+b" if os.path.exists(self.data_path) else "wb"
+            with open(self.data_path, mode) as f:
+                f.seek(offset)
+                f.write(data)
+            entry.update(fields)
+            entry.update({"run_id": len(self._index), "offset": offset, "n": int(n)})
+            entry.setdefault("ts", time.time())
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._index.append(entry)
+            return entry["run_id"]
+
+    def append_many(self, runs) -> list:
+        """Store [(t, V, I_uA, meta)] with one open of each file; returns their run_ids."""
+        runs = list(runs)
+        if not runs:
+            return []
+        with self._lock:
+            offset = self._end_offset()
+            entries = []
+            mode = "r+b" if os.path.exists(self.data_path) else "wb"
+            with open(self.data_path, mode) as f:
+                f.seek(offset)
+                for t, V, I_uA, meta in runs:
+                    data, n, fields = self._encode(t, V, I_uA)
+                    f.write(data)
+                    entry = dict(meta or {})
+                    entry.update(fields)
+                    entry.update({"run_id": len(self._index) + len(entries), "offset": offset, "n": int(n)})
+                    entry.setdefault("ts", time.time())
+                    entries.append(entry)
+                    offset += len(data)
+            with open(self.index_path, "a") as f:
+                f.write("".join(json.dumps(e) + "\n" for e in entries))
+            self._index.extend(entries)
+            return [e["run_id"] for e in entries]
+
+    def meta(self, run_id) -> dict:
+        return dict(self._index[run_id])
+
+    def runs(self):
+        """Index entries of all runs, oldest first."""
+        return [dict(e) for e in self._index]
+
+    def _data(self):
+        end = self._end_offset()
+        if end == 0:
+            return np.empty(0, dtype=DTYPE)
+        if self._mm is None or self._mm.size * DTYPE.itemsize < end:
+            self._mm = np.memmap(self.data_path, dtype=DTYPE, mode="r",
+                                 shape=(end // DTYPE.itemsize,))
+        return self._mm
+
+    def read(self, run_id):
+        """Return (t, V, I_uA) of one run: float32 memmap views, or decoded arrays for compressed runs."""
+        with self._lock:
+            entry = self._index[run_id]
+            mm = self._data()
+        if entry.get("codec") == CODEC:
+            blob = mm.view(np.uint8)[entry["offset"]:entry["offset"] + entry["nbytes"]]
+            return decode_sweep(blob)
+        start = entry["offset"] // DTYPE.itemsize
+        cols = mm[start:start + N_COLUMNS * entry["n"]].reshape(N_COLUMNS, entry["n"])
+        return cols[0], cols[1], cols[2]
+
+    def iter_runs(self, start=0, stop=None):
+        """Yield (meta, t, V, I_uA) for a range of run ids."""
+        for run_id in range(start, len(self._index) if stop is None else stop):
+            yield (self.meta(run_id),) + self.read(run_id)
+
+
+_archive = None
+
+def get_archive() -> CvArchive:
+    global _archive
+    if _archive is None:
+        _archive = CvArchive()
+    return _archive
@@ -0,0 +1,321 @@
+# data_exchange.py
+"""
+data_exchange.py - Streaming export / import of readings and their raw sweeps.
+
+Readings come from data_storage (keyset-paged) and sweeps from cv_archive
+(memmap views), and are written one record at a time, so memory stays flat
+however long the history is. Three formats, chosen by file extension:
+
+    .csv     readings.csv (one row per reading) + readings_sweeps.csv
+             (uid, t, V, I_uA; one row per sample, in reading order)
+    .jsonl   one JSON object per reading, sweep arrays inline; NaN / inf are
+             written as null (read back as NaN samples, or None like the
+             other readers for reading fields)
+    .ccol    columnar binary: blocks of up to BATCH_SIZE readings, each a JSON
+             header (text columns, column sizes) followed by little-endian
+             float64 / int64 reading columns and float32 sweep columns
+
+Import reads the same formats in batches of BATCH_SIZE. Every reading has a
+uid (rows from foreign CSVs get one derived from ts / concentration / device),
+and readings whose uid is already stored are skipped together with their
+sweeps, so importing a file twice changes nothing.
+
+Usage (from CreatConnect/):
+    python data_exchange.py export backup.ccol
+    python data_exchange.py export last_month.csv --since 2025-06-01 --no-sweeps
+    python data_exchange.py import backup.ccol
+"""
+import argparse, csv, datetime, hashlib, json, os, struct, sys
+import numpy as np
+from data_storage import get_store
+from cv_archive import get_archive
+
+BATCH_SIZE = 256
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ccol": "columnar"}
+FIELDS = ("uid", "ts", "conc_mg_dL", "Ip_uA", "Vp_mV", "status", "calibration_id",
+          "device_id", "source")
+_FLOAT_FIELDS = ("ts", "conc_mg_dL", "Ip_uA", "Vp_mV")
+_TEXT_FIELDS = ("uid", "status", "calibration_id", "source")
+_SWEEP_COLS = ("t", "V", "I_uA")
+_COL_MAGIC = b"CCCOL\x01\n"
+_fmt = "{:.9g}".format          # float32 round-trips exactly with 9 significant digits
+
+def _json_num(v):
+    # JSON has no NaN / inf; null keeps the file readable by any parser
+    return _fmt(v) if np.isfinite(v) else "null"
+
+def _json_value(v):
+    return None if isinstance(v, float) and not np.isfinite(v) else v
+
+def format_of(path, fmt=None):
+    if fmt is not None:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown export format for {path}; use one of {', '.join(FORMATS)}")
+    return FORMATS[ext]
+
+def sweeps_path(path):
+    """Companion file holding the samples of a CSV export."""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_sweeps{ext}"
+
+def _checked(rec):
+    """rec with ts / conc_mg_dL as floats, or None when either is missing or not a number."""
+    try:
+        ts, conc = float(rec["ts"]), float(rec["conc_mg_dL"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (np.isfinite(ts) and np.isfinite(conc)):
+        return None
+    rec["ts"], rec["conc_mg_dL"] = ts, conc
+    return rec
+
+def _uid_of(rec):
+    if rec.get("uid"):
+        return rec["uid"]
+    key = f"{float(rec['ts'])!r}|{float(rec['conc_mg_dL'])!r}|{rec.get('device_id')}"
+    return hashlib.sha1(key.encode()).hexdigest()[:32]
+
+# --- export ---
+def iter_records(since=None, until=None, sweeps=True, store=None, archive=None):
+    """Yield reading dicts (FIELDS + "sweep": (t, V, I_uA) or None), oldest first."""
+    store = get_store() if store is None else store
+    if archive is None and sweeps:
+        archive = get_archive()
+    for row in store.iter_rows(since, until):
+        rec = {k: row.get(k) for k in FIELDS}
+        run_id = row.get("run_id")
+        rec["sweep"] = archive.read(run_id) if sweeps and run_id is not None and run_id < len(archive) else None
+        yield rec
+
+def _write_csv(path, records):
+    n = 0
+    with open(path, "w", newline="") as f, open(sweeps_path(path), "w", newline="") as fs:
+        out, out_s = csv.writer(f), csv.writer(fs)
+        out.writerow(FIELDS + ("sweep_points",))
+        out_s.writerow(("uid",) + _SWEEP_COLS)
+        for rec in records:
+            sweep = rec.get("sweep")
+            out.writerow([("" if rec.get(k) is None else rec[k]) for k in FIELDS]
+                         + [0 if sweep is None else len(sweep[0])])
+            if sweep is not None:
+                cols = [list(map(_fmt, c.tolist())) for c in sweep]
+                out_s.writerows([rec["uid"], *sample] for sample in zip(*cols))
+            n += 1
+    return n
+
+def _write_jsonl(path, records):
+    n = 0
+    with open(path, "w") as f:
+        for rec in records:
+            line = json.dumps({k: _json_value(rec.get(k)) for k in FIELDS}, allow_nan=False)
+            sweep = rec.get("sweep")
+            if sweep is not None:
+                arrays = ", ".join(f'"{name}": [{",".join(map(_json_num, c.tolist()))}]'
+                                   for name, c in zip(_SWEEP_COLS, sweep))
+                line = line[:-1] + f', "sweep": {{{arrays}}}}}'
+            f.write(line + "\n")
+            n += 1
+    return n
+
+def _col_block(batch):
+    header = {"n": len(batch), "text": {k: [r.get(k) for r in batch] for k in _TEXT_FIELDS}, "columns": []}
+    parts = []
+    def add(name, arr):
+        header["columns"].append([name, arr.dtype.str, arr.nbytes])
+        parts.append(arr.tobytes())
+    for k in _FLOAT_FIELDS:
+        add(k, np.array([np.nan if r.get(k) is None else r[k] for r in batch], dtype="<f8"))
+    add("device_id", np.array([-1 if r.get("device_id") is None else r["device_id"] for r in batch], dtype="<i8"))
+    sweeps = [r.get("sweep") for r in batch]
+    add("sweep_n", np.array([-1 if s is None else len(s[0]) for s in sweeps], dtype="<i8"))
+    for i, name in enumerate(_SWEEP_COLS):
+        add(name, np.concatenate([np.asarray(s[i], dtype="<f4") for s in sweeps if s is not None]
+                                 or [np.empty(0, dtype="<f4")]))
+    head = json.dumps(header).encode()
+    return struct.pack("<I", len(head)) + head + b"".join(parts)
+
+def _batches(records, size=BATCH_SIZE):
+    batch = []
+    for rec in records:
+        batch.append(rec)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _write_columnar(path, records):
+    n = 0
+    with open(path, "wb") as f:
+        f.write(_COL_MAGIC)
+        for batch in _batches(records):
+            f.write(_col_block(batch))
+            n += len(batch)
+    return n
+
+_WRITERS = {"csv": _write_csv, "jsonl": _write_jsonl, "columnar": _write_columnar}
+
+def export(path, fmt=None, since=None, until=None, sweeps=True, records=None):
+    """Stream readings (default: the whole store) to path; returns the number written."""
+    fmt = format_of(path, fmt)
+    if records is None:
+        records = iter_records(since, until, sweeps)
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = path + ".tmp"
+    n = _WRITERS[fmt](tmp, records)
+    os.replace(tmp, path)
+    if fmt == "csv":
+        os.replace(sweeps_path(tmp), sweeps_path(path))
+    return n
+
+# --- import ---
+def _opt_float(s):
+    """float(s), or None for empty / non-numeric cells (such rows are reported, not fatal)."""
+    try:
+        return float(s) if s not in ("", None) else None
+    except ValueError:
+        return None
+
+def _read_csv(path):
+    s_path = sweeps_path(path)
+    with open(path, "r", newline="") as f:
+        fs = open(s_path, "r", newline="") if os.path.exists(s_path) else None
+        try:
+            samples = csv.reader(fs) if fs is not None else None
+            if samples is not None:
+                next(samples, None)
+            for row in csv.DictReader(f):
+                rec = {k: (row.get(k) or None) for k in FIELDS}
+                for k in _FLOAT_FIELDS:
+                    rec[k] = _opt_float(row.get(k))
+                rec["device_id"] = int(row["device_id"]) if row.get("device_id") else None
+                n = int(row.get("sweep_points") or 0)
+                rec["sweep"] = None
+                if n and samples is not None:
+                    block = np.array([next(samples)[1:] for _ in range(n)], dtype=float)
+                    rec["sweep"] = (block[:, 0], block[:, 1], block[:, 2])
+                yield rec
+        finally:
+            if fs is not None:
+                fs.close()
+
+def _read_jsonl(path):
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            rec = {k: obj.get(k) for k in FIELDS}
+            sweep = obj.get("sweep")
+            rec["sweep"] = None
+            if sweep:
+                rec["sweep"] = tuple(np.array([np.nan if v is None else v for v in sweep[c]], dtype=float)
+                                     for c in _SWEEP_COLS)
+            yield rec
+
+def _read_columnar(path):
+    with open(path, "rb") as f:
+        if f.read(len(_COL_MAGIC)) != _COL_MAGIC:
+            raise ValueError(f"{path} is not a columnar export")
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                return
+            header = json.loads(f.read(struct.unpack("<I", size)[0]))
+            cols = {name: np.frombuffer(f.read(nbytes), dtype=dtype)
+                    for name, dtype, nbytes in header["columns"]}
+            ends = np.cumsum(np.maximum(cols["sweep_n"], 0))
+            for i in range(header["n"]):
+                rec = {k: header["text"][k][i] for k in _TEXT_FIELDS}
+                for k in _FLOAT_FIELDS:
+                    v = float(cols[k][i])
+                    rec[k] = None if np.isnan(v) else v
+                rec["device_id"] = None if cols["device_id"][i] < 0 else int(cols["device_id"][i])
+                n = int(cols["sweep_n"][i])
+                rec["sweep"] = None
+                if n >= 0:
+                    lo = int(ends[i]) - n
+                    rec["sweep"] = tuple(cols[c][lo:lo + n] for c in _SWEEP_COLS)
+                yield rec
+
+_READERS = {"csv": _read_csv, "jsonl": _read_jsonl, "columnar": _read_columnar}
+
+def iter_file(path, fmt=None):
+    """Yield records from an export file, one at a time."""
+    return _READERS[format_of(path, fmt)](path)
+
+def import_records(records, store=None, archive=None, source_name=None):
+    """
+    Insert records not yet stored, in batches; returns (read, inserted, skipped).
+    Records without a usable ts or concentration are skipped.
+    """
+    store = get_store() if store is None else store
+    archive = get_archive() if archive is None else archive
+    n_read = n_new = n_bad = 0
+    for raw in _batches(records):
+        n_read += len(raw)
+        batch = [rec for rec in map(_checked, raw) if rec is not None]
+        n_bad += len(raw) - len(batch)
+        for rec in batch:
+            rec["uid"] = _uid_of(rec)
+        known = store.existing_uids(r["uid"] for r in batch)
+        fresh, seen = [], set()
+        for rec in batch:
+            if rec["uid"] not in known and rec["uid"] not in seen:
+                seen.add(rec["uid"])
+                fresh.append(rec)
+        with_sweep = [r for r in fresh if r.get("sweep") is not None]
+        run_ids = archive.append_many(
+            (*r["sweep"], {"device_id": r.get("device_id"), "ts": r["ts"], "uid": r["uid"],
+                           "imported_from": source_name}) for r in with_sweep)
+        for rec, run_id in zip(with_sweep, run_ids):
+            rec["run_id"] = run_id
+        n_new += store.add_many(fresh)
+    store.flush()
+    return n_read, n_new, n_bad
+
+def import_file(path, fmt=None, store=None, archive=None):
+    """Import an export file; returns (read, inserted, skipped). Safe to repeat."""
+    return import_records(iter_file(path, fmt), store, archive, os.path.basename(path))
+
+# --- CLI ---
+def _parse_time(s):
+    if s is None:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.datetime.fromisoformat(s).timestamp()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export / import CreatConnect readings and sweeps.")
+    ap.add_argument("action", choices=("export", "import"))
+    ap.add_argument("path", help="file to write / read (.csv, .jsonl or .ccol)")
+    ap.add_argument("--since", help="ISO date or unix time (export)")
+    ap.add_argument("--until", help="ISO date or unix time (export)")
+    ap.add_argument("--no-sweeps", action="store_true", help="readings only (export)")
+    args = ap.parse_args(argv)
+    try:
+        if args.action == "export":
+            n = export(args.path, since=_parse_time(args.since), until=_parse_time(args.until),
+                       sweeps=not args.no_sweeps)
+            print(f"Exported {n} readings to {args.path}")
+        else:
+            n_read, n_new, n_bad = import_file(args.path)
+            print(f"Imported {n_new} new readings ({n_read - n_new - n_bad} already present) from {args.path}")
+            if n_bad:
+                print(f"Skipped {n_bad} records without a valid ts / conc_mg_dL")
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        print("Error:", e)
+        return 2
+    finally:
+        get_store().close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,392 @@
 '''
 data_storage.py - Manages storage & retrieval of creatinine measurement history.
+
+Readings live in one SQLite database (WAL mode, so screens can read while a
+measurement is being written) and every screen reads from it:
+
+    readings(id, ts, conc_mg_dL, Ip_uA, Vp_mV, status, calibration_id,
+             run_id, device_id, source, uid)
+
+ts is a unix timestamp; run_id points at the raw sweep in cv_archive; uid is
+a random id that stays with the reading across exports / imports;
+calibration_id is the sha256 of the calibration file used. ts and status are
+indexed, so range / latest / per-status queries are O(log n).
+Writes are grouped: rows are committed every COMMIT_EVERY inserts or
+COMMIT_INTERVAL_S seconds, whichever comes first, and on flush() / close().
+
+Screens subscribe() to changes instead of re-reading the table: callbacks get
+("added", reading), ("cleared", None) or ("reloaded", None) on the writing
+thread. The total count and the latest reading are cached, so count() and
+last() don't touch the database after the first call.
+
+Trend views read rollups instead of raw readings: every insert also updates
+one row per hour / day / week bucket (local time, weeks start on Monday)
+
+    rollups(period, bucket, count, min, max, sum, last, last_ts)
+
+so a year of history is at most 365 day rows or 53 week rows.
 '''
+import datetime, sqlite3, threading, time, uuid
+
+DB_FILE = "readings.db"
+COMMIT_EVERY = 16
+COMMIT_INTERVAL_S = 2.0
+PAGE_SIZE = 50
+SCHEMA_VERSION = 3
+PERIODS = ("hour", "day", "week")
+TREND_MAX_POINTS = 400
+
+COLUMNS = ("id", "ts", "conc_mg_dL", "Ip_uA", "Vp_mV", "status",
+           "calibration_id", "run_id", "device_id", "source", "uid")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id             INTEGER PRIMARY KEY,
+    ts             REAL    NOT NULL,
+    conc_mg_dL     REAL    NOT NULL,
+    Ip_uA          REAL,
+    Vp_mV          REAL,
+    status         TEXT,
+    calibration_id TEXT,
+    run_id         INTEGER,
+    device_id      INTEGER,
+    source         TEXT,
+    uid            TEXT
+);
+CREATE INDEX IF NOT EXISTS readings_ts ON readings(ts);
+CREATE INDEX IF NOT EXISTS readings_status_ts ON readings(status, ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    period  TEXT    NOT NULL,
+    bucket  REAL    NOT NULL,
+    count   INTEGER NOT NULL,
+    min     REAL    NOT NULL,
+    max     REAL    NOT NULL,
+    sum     REAL    NOT NULL,
+    last    REAL    NOT NULL,
+    last_ts REAL    NOT NULL,
+    PRIMARY KEY (period, bucket)
+) WITHOUT ROWID;
+"""
+
+_INSERT = ("INSERT INTO readings (ts, conc_mg_dL, Ip_uA, Vp_mV, status, calibration_id,"
+           " run_id, device_id, source, uid) VALUES (?,?,?,?,?,?,?,?,?,?)")
+_INSERT_NEW = _INSERT.replace("INSERT", "INSERT OR IGNORE", 1)
+
+_UPSERT_ROLLUP = """
+INSERT INTO rollups (period, bucket, count, min, max, sum, last, last_ts) VALUES (?,?,1,?,?,?,?,?)
+ON CONFLICT (period, bucket) DO UPDATE SET
+    count = count + 1,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    sum = sum + excluded.sum,
+    last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+    last_ts = MAX(last_ts, excluded.last_ts)
+"""
+
+_PERIOD_SECONDS = {"hour": 3600.0, "day": 86400.0, "week": 7 * 86400.0}
+
+def bucket_start(ts, period):
+    """Start (unix time) of the local hour / day / week containing ts."""
+    t = datetime.datetime.fromtimestamp(ts)
+    if period == "hour":
+        t = t.replace(minute=0, second=0, microsecond=0)
+    elif period == "day":
+        t = t.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif period == "week":
+        t = t.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=t.weekday())
+    else:
+        raise ValueError(f"Unknown rollup period: {period}")
+    return t.timestamp()
+
+def _rollup_params(ts, conc):
+    return [(period, bucket_start(ts, period), conc, conc, conc, conc, ts) for period in PERIODS]
+
+_UNKNOWN = object()
+
+class ReadingsStore:
+    def __init__(self, path=DB_FILE, commit_every=COMMIT_EVERY, commit_interval_s=COMMIT_INTERVAL_S):
+        self.path = path
+        self.commit_every = int(commit_every)
+        self.commit_interval_s = float(commit_interval_s)
+        # one connection shared by the UI and worker threads, serialised by _lock
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._pending = 0          # rows written since the last commit
+        self._timer = None
+        self._subscribers = []
+        self._count = None         # cached COUNT(*), None until first needed
+        self._last = _UNKNOWN      # cached newest reading (None when empty)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            self._db.executescript(_SCHEMA)
+            if version < 2:
+                self.rebuild_rollups()
+            if version < 3:
+                self._add_uids()
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    # --- writes ---
+    def add(self, conc_mg_dL, ts=None, Ip_uA=None, Vp_mV=None, status=None,
+            calibration_id=None, run_id=None, device_id=None, source=None, uid=None) -> int:
+        """Insert one reading and return its id (visible to readers at once)."""
+        row = (time.time() if ts is None else float(ts), float(conc_mg_dL), Ip_uA, Vp_mV,
+               status, calibration_id, run_id, device_id, source, uid or uuid.uuid4().hex)
+        with self._lock:
+            self._begin()
+            cur = self._db.execute(_INSERT, row)
+            self._db.executemany(_UPSERT_ROLLUP, _rollup_params(row[0], row[1]))
+            self._wrote(1)
+            reading = dict(zip(COLUMNS, (cur.lastrowid,) + row))
+            if self._count is not None:
+                self._count += 1
+            if self._last is not _UNKNOWN and (self._last is None or
+                                               (reading["ts"], reading["id"]) >= (self._last["ts"], self._last["id"])):
+                self._last = reading
+        self._notify("added", reading)
+        return reading["id"]
+
+    def add_many(self, rows):
+        """
+        Insert dicts with COLUMNS keys (id ignored). Rows whose uid is already
+        stored are skipped, so re-importing the same data is harmless.
+        Returns the number inserted.
+        """
+        params = [(time.time() if r.get("ts") is None else float(r["ts"]), float(r["conc_mg_dL"]), r.get("Ip_uA"),
+                   r.get("Vp_mV"), r.get("status"), r.get("calibration_id"), r.get("run_id"),
+                   r.get("device_id"), r.get("source"), r.get("uid") or uuid.uuid4().hex) for r in rows]
+        if not params:
+            return 0
+        inserted = 0
+        with self._lock:
+            self._begin()
+            for p in params:
+                if self._db.execute(_INSERT_NEW, p).rowcount:
+                    self._db.executemany(_UPSERT_ROLLUP, _rollup_params(p[0], p[1]))
+                    inserted += 1
+            self._wrote(inserted)
+            if self._count is not None:
+                self._count += inserted
+            self._last = _UNKNOWN
+        if inserted:
+            self._notify("reloaded", None)
+        return inserted
+
+    def existing_uids(self, uids):
+        """The subset of uids that are already stored."""
+        uids = list(uids)
+        found = set()
+        for i in range(0, len(uids), 500):          # stay under SQLite's variable limit
+            chunk = uids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            found.update(r["uid"] for r in self._query(f"SELECT uid FROM readings WHERE uid IN ({marks})", chunk))
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._begin()
+            self._db.execute("DELETE FROM readings")
+            self._db.execute("DELETE FROM rollups")
+            self._commit()
+            self._count, self._last = 0, None
+        self._notify("cleared", None)
+
+    def flush(self):
+        """Commit any pending writes."""
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+    def _add_uids(self):
+        cols = [r["name"] for r in self._db.execute("PRAGMA table_info(readings)")]
+        if "uid" not in cols:
+            self._db.execute("ALTER TABLE readings ADD COLUMN uid TEXT")
+        self._db.execute("UPDATE readings SET uid = lower(hex(randomblob(16))) WHERE uid IS NULL")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS readings_uid ON readings(uid)")
+
+    def rebuild_rollups(self):
+        """Recompute every rollup from the readings table (schema upgrades, repairs)."""
+        with self._lock:
+            self._begin()
+            self._db.execute("DELETE FROM rollups")
+            for ts, conc in self._db.execute("SELECT ts, conc_mg_dL FROM readings ORDER BY ts").fetchall():
+                self._db.executemany(_UPSERT_ROLLUP, _rollup_params(ts, conc))
+            self._commit()
+
+    # --- change events ---
+    def subscribe(self, fn):
+        """Call fn(event, reading) after every change; runs on the writing thread."""
+        with self._lock:
+            if fn not in self._subscribers:
+                self._subscribers.append(fn)
+
+    def unsubscribe(self, fn):
+        with self._lock:
+            if fn in self._subscribers:
+                self._subscribers.remove(fn)
+
+    def _notify(self, event, reading):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for fn in subscribers:
+            try:
+                fn(event, reading)
+            except Exception as e:
+                print("Readings subscriber error:", e)
+
+    def _begin(self):
+        if not self._db.in_transaction:
+            self._db.execute("BEGIN")
+
+    def _wrote(self, n):
+        self._pending += n
+        if self._pending >= self.commit_every:
+            self._commit()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.commit_interval_s, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _commit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._db.in_transaction:
+            self._db.execute("COMMIT")
+        self._pending = 0
+
+    # --- reads ---
+    def _query(self, sql, args=()):
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, args)]
+
+    @staticmethod
+    def _where(since=None, until=None, status=None):
+        clauses, args = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            args.append(status)
+        if since is not None:
+            clauses.append("ts >= ?")
+            args.append(float(since))
+        if until is not None:
+            clauses.append("ts < ?")
+            args.append(float(until))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def count(self, since=None, until=None, status=None) -> int:
+        where, args = self._where(since, until, status)
+        with self._lock:
+            if not where and self._count is not None:
+                return self._count
+            n = self._db.execute("SELECT COUNT(*) FROM readings" + where, args).fetchone()[0]
+            if not where:
+                self._count = n
+            return n
+
+    def get(self, reading_id):
+        rows = self._query("SELECT * FROM readings WHERE id = ?", (int(reading_id),))
+        return rows[0] if rows else None
+
+    def last(self):
+        """Most recent reading as a dict, or None."""
+        with self._lock:
+            if self._last is _UNKNOWN:
+                rows = self.latest(1)
+                self._last = rows[0] if rows else None
+            return self._last
+
+    def latest(self, n=1, status=None):
+        """The n most recent readings, newest first."""
+        where, args = self._where(status=status)
+        return self._query(f"SELECT * FROM readings{where} ORDER BY ts DESC, id DESC LIMIT ?",
+                           args + [int(n)])
+
+    def page(self, before=None, limit=PAGE_SIZE, status=None):
+        """
+        Up to `limit` readings older than the key `before` = (ts, id), newest
+        first; None starts at the newest. Pass the last row's (ts, id) to get
+        the next page (keyset paging: every page is an index seek).
+        """
+        where, args = self._where(status=status)
+        if before is not None:
+            where += (" AND " if where else " WHERE ") + "(ts, id) < (?, ?)"
+            args += [float(before[0]), int(before[1])]
+        return self._query(f"SELECT * FROM readings{where} ORDER BY ts DESC, id DESC LIMIT ?",
+                           args + [int(limit)])
+
+    def iter_rows(self, since=None, until=None, batch=PAGE_SIZE):
+        """Yield readings oldest first, fetching `batch` rows at a time (keyset paging)."""
+        where, args = self._where(since, until)
+        key = None
+        while True:
+            sql, page_args = "SELECT * FROM readings" + where, list(args)
+            if key is not None:
+                sql += (" AND " if where else " WHERE ") + "(ts, id) > (?, ?)"
+                page_args += list(key)
+            rows = self._query(sql + " ORDER BY ts, id LIMIT ?", page_args + [int(batch)])
+            yield from rows
+            if len(rows) < batch:
+                return
+            key = rows[-1]["ts"], rows[-1]["id"]
+
+    def range(self, since=None, until=None, status=None, limit=None, newest_first=False):
+        """Readings with since <= ts < until (either bound optional)."""
+        where, args = self._where(since, until, status)
+        order = "DESC" if newest_first else "ASC"
+        sql = f"SELECT * FROM readings{where} ORDER BY ts {order}, id {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return self._query(sql, args)
+
+    # --- rollups ---
+    def rollups(self, period="day", since=None, until=None):
+        """
+        Per-bucket aggregates with since <= bucket start < until, oldest first:
+        dicts with bucket, count, min, max, mean, last.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Unknown rollup period: {period}")
+        sql = ("SELECT bucket, count, min, max, sum / count AS mean, last FROM rollups"
+               " WHERE period = ?")
+        args = [period]
+        if since is not None:
+            sql += " AND bucket >= ?"
+            args.append(bucket_start(float(since), period))
+        if until is not None:
+            sql += " AND bucket < ?"
+            args.append(float(until))
+        return self._query(sql + " ORDER BY bucket", args)
+
+    def trend(self, since=None, until=None, max_points=TREND_MAX_POINTS):
+        """(period, rollups) at the finest period giving at most max_points buckets."""
+        first = self._query("SELECT MIN(ts) AS lo, MAX(ts) AS hi FROM readings")[0]
+        if first["lo"] is None:
+            return PERIODS[0], []
+        lo = first["lo"] if since is None else max(float(since), first["lo"])
+        hi = first["hi"] if until is None else min(float(until), first["hi"])
+        for period in PERIODS:
+            if (hi - lo) / _PERIOD_SECONDS[period] < max_points:
+                break
+        return period, self.rollups(period, since, until)
+
+
+_store = None
+
+def get_store() -> ReadingsStore:
+    global _store
+    if _store is None:
+        _store = ReadingsStore()
+    return _store
 
-# store readings using Pandas DataFrame
\ No newline at end of file
+def set_store(store):
+    """Use another ReadingsStore (e.g. a temporary database) as the shared one."""
+    global _store
+    _store = store
@@ -0,0 +1,74 @@
+# decimation.py
+"""
+decimation.py - Reduce a plotted series to roughly what the screen can show.
+
+Both methods bucket by sample order, not by x, so they work on CV loops where
+V goes back and forth. The returned value is an increasing index array into
+the original series; the global min / max of y and any `keep` indices (e.g.
+the analysed peak) are always included, so peaks are drawn exactly.
+
+    minmax   first, min, max and last sample of every bucket; one reshape,
+             fully vectorised
+    lttb     Largest-Triangle-Three-Buckets: one point per bucket chosen to
+             keep the visual shape (x and y normalised to the view first)
+"""
+import numpy as np
+
+def _with_kept(idx, y, keep):
+    extra = [int(np.argmin(y)), int(np.argmax(y))]
+    extra += [int(k) for k in keep if 0 <= int(k) < y.size]
+    return np.union1d(idx, np.asarray(extra, dtype=np.intp))
+
+def minmax(y, n_out, keep=()):
+    """Indices of about n_out points: per bucket its first, min, max and last sample."""
+    y = np.asarray(y, dtype=float)
+    n = y.size
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+    n_buckets = max(1, n_out // 4)
+    size = -(-n // n_buckets)                     # ceil
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(n_buckets, size)
+    starts = np.arange(n_buckets) * size
+    valid = starts < n
+    filled = np.where(np.isnan(blocks), np.inf, blocks)
+    lo = starts + np.argmin(filled, axis=1)
+    filled = np.where(np.isnan(blocks), -np.inf, blocks)
+    hi = starts + np.argmax(filled, axis=1)
+    last = np.minimum(starts + size, n) - 1
+    idx = np.concatenate([starts[valid], lo[valid], hi[valid], last[valid]])
+    return _with_kept(np.unique(idx), y, keep)
+
+def lttb(x, y, n_out, keep=()):
+    """Indices of n_out points chosen by Largest-Triangle-Three-Buckets."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = y.size
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    # triangle areas are compared in screen-like units
+    xs = (x - x.min()) / (np.ptp(x) or 1.0)
+    ys = (y - y.min()) / (np.ptp(y) or 1.0)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)    # n_out - 2 inner buckets
+    out = np.empty(n_out, dtype=np.intp)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], max(edges[b + 1], edges[b] + 1)
+        nlo, nhi = hi, max(edges[b + 2] if b + 2 < edges.size else n, hi + 1)
+        cx, cy = xs[nlo:nhi].mean(), ys[nlo:nhi].mean()        # next bucket's centroid
+        area = np.abs((xs[a] - cx) * (ys[lo:hi] - ys[a]) - (xs[a] - xs[lo:hi]) * (cy - ys[a]))
+        a = lo + int(np.argmax(area))
+        out[b + 1] = a
+    return _with_kept(np.unique(out), y, keep)
+
+METHODS = {"minmax": minmax, "lttb": lttb}
+
+def decimate(x, y, n_out, method="minmax", keep=()):
+    """Index array selecting about n_out points of (x, y) with `method`."""
+    if method == "lttb":
+        return lttb(x, y, n_out, keep)
+    if method == "minmax":
+        return minmax(y, n_out, keep)
+    raise ValueError(f"Unknown decimation method: {method}")
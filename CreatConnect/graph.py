@@ -10,11 +10,61 @@ graph.py - Handles graphing of historical creatinine levels.
     - Provide personalized alerts before a major health issue occurs.
 """
 
+import numpy as np
 from kivy_garden.graph import Graph, LinePlot
 from kivy.uix.boxlayout import BoxLayout
+from kivy.clock import Clock
+from decimation import decimate
+
+POINTS_PER_PIXEL = 2          # plotted vertices per horizontal pixel
+MIN_PLOT_POINTS = 200
+DEFAULT_CAPACITY = 200000     # samples kept per series; older ones are dropped
+
+class RingSeries:
+    """Fixed-capacity (x, y) sample buffer; appends are vectorised and O(chunk)."""
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = int(capacity)
+        self._x = np.empty(self.capacity)
+        self._y = np.empty(self.capacity)
+        self.clear()
+
+    def clear(self):
+        self._head = 0          # next write position
+        self._size = 0
+        self.dropped = 0        # samples overwritten since clear(); index offset of the view
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, xs, ys):
+        xs = np.asarray(xs, dtype=float).ravel()
+        ys = np.asarray(ys, dtype=float).ravel()
+        n = min(xs.size, ys.size)
+        if n == 0:
+            return
+        if n > self.capacity:
+            self.dropped += n - self.capacity
+            xs, ys, n = xs[n - self.capacity:n], ys[n - self.capacity:n], self.capacity
+        first = min(n, self.capacity - self._head)     # up to the end of the array, then wrap
+        self._x[self._head:self._head + first] = xs[:first]
+        self._y[self._head:self._head + first] = ys[:first]
+        self._x[:n - first] = xs[first:n]
+        self._y[:n - first] = ys[first:n]
+        self._head = (self._head + n) % self.capacity
+        overflow = max(0, self._size + n - self.capacity)
+        self.dropped += overflow
+        self._size = min(self.capacity, self._size + n)
+
+    def view(self):
+        """(x, y) in arrival order; copies only when the buffer has wrapped."""
+        start = (self._head - self._size) % self.capacity
+        if start + self._size <= self.capacity:
+            return self._x[start:start + self._size], self._y[start:start + self._size]
+        return (np.concatenate([self._x[start:], self._x[:self._head]]),
+                np.concatenate([self._y[start:], self._y[:self._head]]))
 
 class CreatinineGraph(BoxLayout):
-    def __init__(self, **kwargs):
+    def __init__(self, capacity=DEFAULT_CAPACITY, **kwargs):
         super().__init__(**kwargs)
 
         self.graph = Graph(
@@ -41,25 +91,55 @@ class CreatinineGraph(BoxLayout):
         self.graph.add_plot(self.plot)
         self.add_widget(self.graph)
 
-        # buffers for fast incremental updates
-        self._x, self._y = [], []
+        # full-resolution series; only a decimated view is handed to the LinePlot
+        self._series = RingSeries(capacity)
+        self._keep = ()                   # sample indices always drawn (e.g. the analysed peak)
+        self.decimation = "minmax"        # or "lttb"; None plots every point
+        # appends only mark the plot dirty; it is rebuilt at most once per frame
+        self._redraw = Clock.create_trigger(self._refresh_points)
+        # re-decimate for the new pixel width / visible range
+        self.graph.bind(size=self._redraw, xmin=self._redraw, xmax=self._redraw)
 
-    def update_graph(self, x_vals, y_vals):
+    def update_graph(self, x_vals, y_vals, keep=()):
         # optional: guard for mismatched lengths
         n = min(len(x_vals), len(y_vals))
-        self._x = list(x_vals[:n])
-        self._y = list(y_vals[:n])
-        self.plot.points = list(zip(self._x, self._y))
+        self._series.clear()
+        self._series.extend(x_vals[:n], y_vals[:n])
+        self._keep = tuple(keep)
+        self._refresh_points()
 
     def append_point(self, x, y):
-        self._x.append(x)
-        self._y.append(y)
-        self.plot.points = list(zip(self._x, self._y))
+        self.append_points([x], [y])
+
+    def append_points(self, x_vals, y_vals):
+        # coalesced: any number of appends within a frame cost one redraw
+        self._series.extend(x_vals, y_vals)
+        self._redraw()
 
     def clear(self):
-        self._x, self._y = [], []
+        self._series.clear()
+        self._keep = ()
         self.plot.points = []
 
+    def _target_points(self):
+        return max(MIN_PLOT_POINTS, int(POINTS_PER_PIXEL * self.graph.width))
+
+    def _refresh_points(self, *args):
+        x, y = self._series.view()
+        if self.decimation is None or x.size <= self._target_points():
+            self.plot.points = list(zip(x.tolist(), y.tolist()))
+            return
+        # when zoomed in, decimate only what is on screen (plus the neighbours
+        # that carry the line to the edge) so the full budget goes to the view
+        visible = (x >= self.graph.xmin) & (x <= self.graph.xmax)
+        visible[1:] |= visible[:-1].copy()
+        visible[:-1] |= visible[1:].copy()
+        base = np.flatnonzero(visible) if not visible.all() else np.arange(x.size)
+        keep = [k - self._series.dropped for k in self._keep]
+        keep = np.searchsorted(base, [k for k in keep if 0 <= k < x.size and visible[k]])
+        idx = base[decimate(x[base], y[base], self._target_points(), self.decimation, keep)]
+        self.plot.points = list(zip(x[idx].tolist(), y[idx].tolist()))
+
     def set_limits(self, xmin, xmax, ymin, ymax, pad_y_frac=0.05):
         self.graph.xmin, self.graph.xmax = float(xmin), float(xmax)
         pad = pad_y_frac * (ymax - ymin)
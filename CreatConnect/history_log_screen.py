@@ -4,22 +4,25 @@ from kivy.uix.label import Label
 from kivy.uix.image import Image
 from kivy.uix.anchorlayout import AnchorLayout
 from kivy.uix.widget import Widget
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.gridlayout import GridLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.graphics import Color, Rectangle, Line
 from kivy.metrics import dp
 from kivy.app import App
-from kivy.properties import StringProperty
+from kivy.properties import StringProperty, NumericProperty
 from kivy.core.text import LabelBase
 import json
 import os
 from datetime import datetime
+from data_storage import get_store, PAGE_SIZE
+from ui_dispatch import get_dispatcher
 
 # Constants
 SKETCH_COLOR = (0.2, 0.2, 0.2, 1)  # Dark grey for sketch lines
 SKETCH_COLOR_HEX = "333333"
 HANDWRITTEN_FONT = "Exo2-Bold.otf"
 SKETCH_LINE_WIDTH = 2
+LOAD_MORE_AT = 0.1      # fetch the next page when scrolled this close to the bottom
 
 class SketchButton(Button):
     FIXED_SKETCH_OFFSET_X = dp(2)
@@ -73,52 +76,63 @@ class SketchButton(Button):
             self.sketch_color.rgb = SKETCH_COLOR
 
 class HistoryEntryWidget(BoxLayout):
-    def __init__(self, date, time, creatinine_value, **kwargs):
+    """One history row; a RecycleView reuses a handful of these and only swaps their values."""
+    date = StringProperty("")
+    time = StringProperty("")
+    creatinine_value = NumericProperty(0.0)
+    ts = NumericProperty(0.0)
+
+    def __init__(self, **kwargs):
         super().__init__(orientation='horizontal', size_hint=(1, None), height=dp(60), spacing=dp(10), **kwargs)
         
         # Date and Time
         datetime_container = BoxLayout(orientation='vertical', size_hint=(0.4, 1), spacing=dp(2))
-        date_label = Label(text=date, font_size='14sp', font_name='Roboto', 
+        self.date_label = Label(text=self.date, font_size='14sp', font_name='Roboto', 
                           color=SKETCH_COLOR, size_hint=(1, None), height=dp(25))
-        time_label = Label(text=time, font_size='12sp', font_name='Roboto', 
+        self.time_label = Label(text=self.time, font_size='12sp', font_name='Roboto', 
                           color=(0.5, 0.5, 0.5, 1), size_hint=(1, None), height=dp(20))
-        datetime_container.add_widget(date_label)
-        datetime_container.add_widget(time_label)
+        datetime_container.add_widget(self.date_label)
+        datetime_container.add_widget(self.time_label)
         
         # Creatinine Value
         creatinine_container = BoxLayout(orientation='vertical', size_hint=(0.3, 1), spacing=dp(2))
         creatinine_label = Label(text="Creatinine", font_size='12sp', font_name='Roboto', 
                                color=(0.5, 0.5, 0.5, 1), size_hint=(1, None), height=dp(20))
-        value_label = Label(text=f"{creatinine_value:.2f} mg/dL", font_size='16sp', font_name='Roboto', 
+        self.value_label = Label(font_size='16sp', font_name='Roboto', 
                            color=SKETCH_COLOR, size_hint=(1, None), height=dp(30))
         creatinine_container.add_widget(creatinine_label)
-        creatinine_container.add_widget(value_label)
+        creatinine_container.add_widget(self.value_label)
         
         # Status indicator
         status_container = BoxLayout(orientation='vertical', size_hint=(0.3, 1), spacing=dp(2))
         status_label = Label(text="Status", font_size='12sp', font_name='Roboto', 
                             color=(0.5, 0.5, 0.5, 1), size_hint=(1, None), height=dp(20))
-        
-        # Determine status based on creatinine value
-        if creatinine_value > 1.3:
-            status_text = "High"
-            status_color = (0.8, 0, 0, 1)  # Red
-        elif creatinine_value < 0.6:
-            status_text = "Low"
-            status_color = (1, 0.5, 0, 1)  # Orange
-        else:
-            status_text = "Normal"
-            status_color = (0, 0.7, 0, 1)  # Green
-            
-        status_value = Label(text=status_text, font_size='14sp', font_name='Roboto', 
-                            color=status_color, size_hint=(1, None), height=dp(30))
+        self.status_value = Label(font_size='14sp', font_name='Roboto', 
+                            size_hint=(1, None), height=dp(30))
         status_container.add_widget(status_label)
-        status_container.add_widget(status_value)
+        status_container.add_widget(self.status_value)
         
         self.add_widget(datetime_container)
         self.add_widget(creatinine_container)
         self.add_widget(status_container)
 
+        self.bind(date=self.date_label.setter('text'), time=self.time_label.setter('text'),
+                  creatinine_value=self._show_value)
+        self._show_value(self, self.creatinine_value)
+
+    def _show_value(self, instance, creatinine_value):
+        self.value_label.text = f"{creatinine_value:.2f} mg/dL"
+        # Determine status based on creatinine value
+        if creatinine_value > 1.3:
+            self.status_value.text = "High"
+            self.status_value.color = (0.8, 0, 0, 1)  # Red
+        elif creatinine_value < 0.6:
+            self.status_value.text = "Low"
+            self.status_value.color = (1, 0.5, 0, 1)  # Orange
+        else:
+            self.status_value.text = "Normal"
+            self.status_value.color = (0, 0.7, 0, 1)  # Green
+
 class HistoryLogScreen(BoxLayout):
     def __init__(self, **kwargs):
         super().__init__(orientation='vertical', spacing=dp(15), padding=dp(15), **kwargs)
@@ -164,13 +178,17 @@ class HistoryLogScreen(BoxLayout):
         # Scrollable History List
         scroll_container = BoxLayout(orientation='vertical', size_hint=(1, 1))
         
-        # Create scroll view for history entries
-        self.scroll_view = ScrollView(size_hint=(1, 1))
-        self.history_layout = GridLayout(cols=1, spacing=dp(5), size_hint_y=None)
-        self.history_layout.bind(minimum_height=self.history_layout.setter('height'))
+        # Recycled list: only the rows on screen are widgets; readings are
+        # fetched from the store a page at a time as the user scrolls down
+        self.history_view = RecycleView(size_hint=(1, 1), viewclass=HistoryEntryWidget)
+        history_layout = RecycleBoxLayout(orientation='vertical', spacing=dp(5), size_hint_y=None,
+                                          default_size=(None, dp(60)), default_size_hint=(1, None))
+        history_layout.bind(minimum_height=history_layout.setter('height'))
+        self.history_view.add_widget(history_layout)
+        self.history_view.bind(scroll_y=self._on_scroll)
+        self._next_page = None      # (ts, id) key of the oldest row loaded, None when exhausted
         
-        self.scroll_view.add_widget(self.history_layout)
-        scroll_container.add_widget(self.scroll_view)
+        scroll_container.add_widget(self.history_view)
         main_content.add_widget(scroll_container)
         
         # Buttons
@@ -183,8 +201,13 @@ class HistoryLogScreen(BoxLayout):
         back_btn = SketchButton(text="Back to Menu", size_hint=(1, 1),
                                font_size='16sp', font_name='Roboto')
         back_btn.bind(on_release=self.go_back_to_menu)
+
+        trend_btn = SketchButton(text="Trend Graph", size_hint=(1, 1),
+                                font_size='16sp', font_name='Roboto')
+        trend_btn.bind(on_release=self.show_trend)
         
         button_container.add_widget(clear_btn)
+        button_container.add_widget(trend_btn)
         button_container.add_widget(back_btn)
         main_content.add_widget(button_container)
         
@@ -195,62 +218,94 @@ class HistoryLogScreen(BoxLayout):
         
         self.add_widget(main_content)
 
-        # Load history data
+        # Load history data, then follow new readings as they are stored
         self.load_history()
+        get_store().subscribe(self._on_store_event)
 
     def load_history(self):
-        """Load and display history data"""
+        """Show the newest page of readings; older pages load on scroll."""
         try:
-            # Clear existing entries
-            self.history_layout.clear_widgets()
-            
-            # Load from app's creatinine readings
-            app = App.get_running_app()
-            print(f"🔍 History Log - Checking app readings: {getattr(app, 'all_creatinine_readings', 'Not found')}")
-            if hasattr(app, 'all_creatinine_readings') and app.all_creatinine_readings:
-                # Display all readings in reverse chronological order (newest first)
-                total_readings = len(app.all_creatinine_readings)
-                
-                for i, creatinine_value in enumerate(reversed(app.all_creatinine_readings)):
-                    # Calculate time offset for each reading
-                    # Most recent reading = current time
-                    # Older readings = progressively earlier times
-                    reading_time = datetime.now()
-                    if i > 0:  # Not the most recent reading
-                        # Subtract time based on how many readings back this is
-                        from datetime import timedelta
-                        # Each reading is 5 minutes apart, going backwards in time
-                        minutes_back = i * 5
-                        reading_time = reading_time - timedelta(minutes=minutes_back)
-                    
-                    # Create history entry
-                    entry = HistoryEntryWidget(
-                        date=reading_time.strftime("%Y-%m-%d"),
-                        time=reading_time.strftime("%H:%M:%S"),
-                        creatinine_value=creatinine_value
-                    )
-                    self.history_layout.add_widget(entry)
-                
-                latest_creatinine = app.all_creatinine_readings[-1]
-                self.status_label.text = f"Total readings: {total_readings} | Latest: {latest_creatinine:.2f} mg/dL"
-                self.status_label.color = (0, 0.7, 0, 1)  # Green
-            else:
-                self.status_label.text = "No history data available"
-                self.status_label.color = (0.5, 0.5, 0.5, 1)  # Gray
+            rows = get_store().page(limit=PAGE_SIZE)
+            self.history_view.data = [self._row_data(r) for r in rows]
+            self._next_page = self._page_key(rows)
+            self.history_view.scroll_y = 1
+            self._update_summary()
                 
         except Exception as e:
             self.status_label.text = f"Error loading history: {str(e)}"
             self.status_label.color = (0.8, 0, 0, 1)  # Red
 
+    def _update_summary(self):
+        # count() and last() are cached by the store, no query per reading
+        store = get_store()
+        latest = store.last()
+        if latest is not None:
+            self.status_label.text = f"Total readings: {store.count()} | Latest: {latest['conc_mg_dL']:.2f} mg/dL"
+            self.status_label.color = (0, 0.7, 0, 1)  # Green
+        else:
+            self.status_label.text = "No history data available"
+            self.status_label.color = (0.5, 0.5, 0.5, 1)  # Gray
+
+    def _on_store_event(self, event, reading):
+        # may run on a worker thread; the widgets are only touched on the Kivy thread
+        get_dispatcher().post(self._apply_store_event, event, reading)
+
+    def _apply_store_event(self, event, reading):
+        if event == "added":
+            data = self.history_view.data
+            if not data or reading["ts"] >= data[0]["ts"]:
+                data.insert(0, self._row_data(reading))
+            elif self._next_page is None or (reading["ts"], reading["id"]) > self._next_page:
+                # back-dated reading inside the loaded range: reload rather than search
+                self.load_history()
+                return
+            self._update_summary()
+        elif event == "cleared":
+            if self.history_view.data:      # cleared elsewhere (e.g. the menu's Reset)
+                self.history_view.data = []
+                self._next_page = None
+                self._update_summary()
+        else:
+            self.load_history()
+
+    def load_more(self):
+        """Append the next (older) page of readings to the list."""
+        if self._next_page is None:
+            return
+        rows = get_store().page(self._next_page, PAGE_SIZE)
+        self._next_page = self._page_key(rows)
+        if rows:
+            self.history_view.data.extend(self._row_data(r) for r in rows)
+
+    def _on_scroll(self, view, scroll_y):
+        # scroll_y is 0 at the bottom of what has been loaded so far
+        if scroll_y <= LOAD_MORE_AT and self._next_page is not None:
+            self.load_more()
+
+    @staticmethod
+    def _page_key(rows):
+        if len(rows) < PAGE_SIZE:
+            return None
+        return rows[-1]["ts"], rows[-1]["id"]
+
+    @staticmethod
+    def _row_data(reading):
+        reading_time = datetime.fromtimestamp(reading["ts"])
+        return {
+            "date": reading_time.strftime("%Y-%m-%d"),
+            "time": reading_time.strftime("%H:%M:%S"),
+            "creatinine_value": reading["conc_mg_dL"],
+            "ts": reading["ts"],
+        }
+
     def clear_history(self, instance):
         """Clear all history data"""
         try:
-            app = App.get_running_app()
-            if hasattr(app, 'all_creatinine_readings'):
-                app.all_creatinine_readings.clear()
+            get_store().clear()
             
             # Clear the display
-            self.history_layout.clear_widgets()
+            self.history_view.data = []
+            self._next_page = None
             
             self.status_label.text = "All history cleared successfully!"
             self.status_label.color = (0, 0.7, 0, 1)  # Green
@@ -259,6 +314,11 @@ class HistoryLogScreen(BoxLayout):
             self.status_label.text = f"Error clearing history: {str(e)}"
             self.status_label.color = (0.8, 0, 0, 1)  # Red
 
+    def show_trend(self, instance):
+        """Long-range trend from the store's hour / day / week rollups"""
+        from visual import HistoryTrendPopup
+        HistoryTrendPopup().open()
+
     def go_back_to_menu(self, instance):
         """Navigate back to the main menu"""
         app = App.get_running_app()
@@ -6,11 +6,15 @@ from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.core.window import Window
 from kivy.core.text import LabelBase # Import LabelBase for font registration
 
-from menu_screen import MenuScreen # Ensure this file and class exist
+from menu_screen import MenuScreen, DATA_SOURCE, SIM_CONCENTRATION_MG_DL # Ensure this file and class exist
 from user_interface import CreatConnectUI # The main sensor UI
 from visual import VisualScreen # Ensure this file and class exist
 from health_info_screen import HealthInfoScreen # Health information screen
 from history_log_screen import HistoryLogScreen # History log screen
+from pstat_session import close_all_sessions, ports_in_use
+from port_finder_rodeo import get_discovery
+from data_storage import get_store
+from snapshot_writer import close_snapshot_writer
 
 import os
 
@@ -27,8 +31,8 @@ LabelBase.register(name="Roboto", fn_regular=roboto_font_path)
 
 class CreatConnectApp(App):
     def build(self):
-        # Initialize the list to store all creatinine readings as an instance attribute.
-        self.all_creatinine_readings = []
+        # Open the readings database every screen reads from
+        self.store = get_store()
 
         # Create the screen manager
         sm = ScreenManager()
@@ -58,10 +62,26 @@ class CreatConnectApp(App):
         history_log_screen.add_widget(HistoryLogScreen())
         sm.add_widget(history_log_screen)
 
+        if DATA_SOURCE == "simulated_pstat":
+            # software potentiostat: same acquisition/calibration path, no hardware
+            import pstat_sim
+            pstat_sim.install(concentration_mg_dL=SIM_CONCENTRATION_MG_DL)
+        else:
+            # Keep the device_id -> port cache warm so "Read Sensor" rarely has to scan
+            get_discovery().start_watching(exclude=ports_in_use)
+
         # Set the initial screen to the menu
         sm.current = 'menu_screen'
 
         return sm
 
+    def on_stop(self):
+        # release the potentiostat connections held between measurements
+        get_discovery().stop_watching()
+        close_all_sessions()
+        # commit any readings still batched in memory, finish queued snapshots
+        get_store().close()
+        close_snapshot_writer()
+
 if __name__ == "__main__":
     CreatConnectApp().run()
\ No newline at end of file
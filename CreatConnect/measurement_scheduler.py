@@ -0,0 +1,343 @@
+# measurement_scheduler.py
+"""
+measurement_scheduler.py - Runs CV measurements on several Rodeostats at once.
+
+Each device gets its own bounded work queue and acquisition thread, so N
+attached potentiostats sweep concurrently with exactly one job in flight per
+device. Finished sweeps are handed to a shared analysis pool
+(concentration_from_cv) while the device starts its next job.
+
+Jobs can be cancelled and carry a deadline; a job that overruns it has its
+connection aborted so a hung device cannot block the queue. All callbacks go
+through one `dispatch(fn, *args)` hook (see ui_dispatch.KivyDispatcher).
+"""
+import queue, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pstat_session import get_session
+from sensor_pipeline import analyze_cv, to_microamps
+from cv_archive import get_archive
+
+MAX_QUEUED_PER_DEVICE = 1      # waiting jobs per device, on top of the one running
+TIMEOUT_FACTOR = 2.0           # default deadline = factor * expected duration + slack
+TIMEOUT_SLACK_S = 10.0
+
+class JobRejected(RuntimeError):
+    """Raised by submit() when the device's queue is full."""
+
+def expected_duration_s(params) -> float:
+    """How long a cyclic test with these params takes on the device."""
+    quiet = float(params.get("quietTime", 0))
+    sweep = float(params.get("period", 0)) * int(params.get("numCycles", 1))
+    return (quiet + sweep) / 1000.0
+
+class MeasurementJob:
+    # states: queued -> running -> analyzing -> done | failed | cancelled | timed_out
+    def __init__(self, device_id, params, curr_range="100uA", sample_period_ms=10,
+                 calibrator=None, name="cyclic", smooth_k=5, peak="reduction",
+                 smooth=None, aggregate=None, reject_flags=(), timeout_s=None,
+                 on_chunk=None, on_done=None, on_error=None):
+        self.device_id = int(device_id)
+        self.params = dict(params)
+        self.curr_range = curr_range
+        self.sample_period_ms = sample_period_ms
+        self.calibrator = calibrator
+        self.name = name
+        self.smooth_k = smooth_k
+        self.smooth = smooth          # smoothing spec (smoothing.py); None = boxcar of smooth_k
+        self.peak = peak
+        self.aggregate = aggregate    # None: one peak over the whole trace; else per half-sweep
+                                      # peaks combined by 'mean' | 'median' | 'last'
+        self.reject_flags = set(reject_flags)   # signal_quality flags that fail the job
+        if timeout_s is None:
+            timeout_s = TIMEOUT_FACTOR * expected_duration_s(self.params) + TIMEOUT_SLACK_S
+        self.timeout_s = float(timeout_s)
+        # callbacks are delivered through the scheduler's dispatch hook
+        self.on_chunk = on_chunk      # (job, t, V, I)
+        self.on_done = on_done        # (job, result dict)
+        self.on_error = on_error      # (job, message); also for cancel / timeout
+        self.submitted_at = time.time()
+        self.state = "queued"
+        self.error = None
+        self._cancel = threading.Event()
+        self._abort = None            # set by the scheduler while the job runs
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Cancel the job; a running job has its device connection aborted."""
+        self._cancel.set()
+        abort = self._abort
+        if abort is not None:
+            abort()
+
+    def __repr__(self):
+        return f"MeasurementJob(device_id={self.device_id}, name={self.name!r}, state={self.state!r})"
+
+
+def _call_direct(fn, *args):
+    fn(*args)
+
+class MeasurementScheduler:
+    def __init__(self, analysis_workers=4, session_getter=get_session,
+                 max_queued=MAX_QUEUED_PER_DEVICE, dispatch=_call_direct, archive=None):
+        self._get_session = session_getter
+        self.archive = archive     # CvArchive that receives every acquired sweep, or None
+        self._analysis = ThreadPoolExecutor(max_workers=analysis_workers,
+                                            thread_name_prefix="cv-analysis")
+        self.max_queued = int(max_queued)
+        self.dispatch = dispatch
+        self._queues = {}      # device_id -> queue.Queue of MeasurementJob
+        self._running = {}     # device_id -> MeasurementJob being acquired
+        self._status = {}      # device_id -> dict, see status()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    # --- public API ---
+    def submit(self, job: MeasurementJob) -> MeasurementJob:
+        """Queue `job`; raises JobRejected if the device already has max_queued waiting."""
+        q = self._queue_for(job.device_id)
+        with self._lock:
+            self._status[job.device_id]["queued"] += 1
+        try:
+            q.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._status[job.device_id]["queued"] -= 1
+            raise JobRejected(f"Device {job.device_id} is busy ({self.max_queued} job(s) waiting)") from None
+        return job
+
+    def busy(self, device_id) -> bool:
+        with self._lock:
+            st = self._status.get(int(device_id))
+            return bool(st) and (st["queued"] > 0 or int(device_id) in self._running)
+
+    def cancel(self, device_id=None):
+        """Cancel the running and queued jobs of one device (or all devices)."""
+        with self._lock:
+            ids = list(self._queues) if device_id is None else [int(device_id)]
+            targets = [self._running[d] for d in ids if d in self._running]
+            for d in ids:
+                q = self._queues.get(d)
+                if q is not None:
+                    with q.mutex:
+                        targets.extend(j for j in q.queue if j is not None)
+        for job in targets:
+            job.cancel()
+
+    def status(self, device_id=None):
+        """
+        Per-device dict: state ('idle' | 'running' | 'analyzing' | 'error'),
+        queued, completed, failed, cancelled, last_error, last_conc.
+        """
+        with self._lock:
+            if device_id is not None:
+                return dict(self._status.get(int(device_id), {}))
+            return {did: dict(st) for did, st in self._status.items()}
+
+    def shutdown(self):
+        self._stopping = True
+        self.cancel()
+        with self._lock:
+            queues = list(self._queues.values())
+        for q in queues:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass   # the loop sees _stopping after its current job
+        self._analysis.shutdown(wait=False)
+
+    # --- internals ---
+    def _queue_for(self, device_id):
+        with self._lock:
+            q = self._queues.get(device_id)
+            if q is None:
+                q = self._queues[device_id] = queue.Queue(maxsize=self.max_queued)
+                self._status[device_id] = {"state": "idle", "queued": 0, "completed": 0,
+                                           "failed": 0, "cancelled": 0,
+                                           "last_error": None, "last_conc": None}
+                threading.Thread(target=self._device_loop, args=(device_id, q),
+                                 name=f"cv-device-{device_id}", daemon=True).start()
+            return q
+
+    def _device_loop(self, device_id, q):
+        while not self._stopping:
+            job = q.get()
+            if job is None:
+                return
+            with self._lock:
+                st = self._status[device_id]
+                st["queued"] -= 1
+            if job.cancelled:
+                self._finish_cancelled(job)
+                continue
+            with self._lock:
+                self._running[device_id] = job
+                st["state"] = "running"
+            job.state = "running"
+            error = None
+            try:
+                t, V, I = self._acquire(job)
+            except Exception as e:
+                error = str(e)
+            with self._lock:
+                self._running.pop(device_id, None)
+            if job.cancelled:
+                self._finish_cancelled(job)
+                continue
+            if error is not None:
+                self._fail(job, error)
+                continue
+            # analysis runs in parallel with this device's next acquisition
+            job.state = "analyzing"
+            with self._lock:
+                st["state"] = "analyzing" if q.empty() else "running"
+            self._analysis.submit(self._analyze, job, t, V, I)
+
+    def _acquire(self, job):
+        session = self._get_session(job.device_id)
+        timed_out = []
+
+        def expire():
+            if not job.cancelled:
+                timed_out.append(True)
+                job.cancel()
+
+        job._abort = session.abort
+        watchdog = threading.Timer(job.timeout_s, expire)
+        watchdog.daemon = True
+        watchdog.start()
+        t, V, I = [], [], []
+        stream = session.run_cv_stream(
+            params=job.params,
+            curr_range=job.curr_range,
+            sample_period_ms=job.sample_period_ms,
+            name=job.name,
+        )
+        try:
+            for t_c, V_c, I_c in stream:
+                if job.cancelled:
+                    break
+                t.extend(t_c)
+                V.extend(V_c)
+                I.extend(I_c)
+                if job.on_chunk is not None:
+                    self.dispatch(job.on_chunk, job, t_c, V_c, I_c)
+        finally:
+            watchdog.cancel()
+            job._abort = None
+            stream.close()     # stops the test on the device if we left early
+            if timed_out:
+                job.state = "timed_out"
+        return t, V, I
+
+    def _analyze(self, job, t, V, I):
+        t = np.asarray(t, dtype=float)
+        V = np.asarray(V, dtype=float)
+        I_uA = to_microamps(np.asarray(I, dtype=float))
+        a = {"conc": None, "Ip_uA": None, "Vp_mV": None, "peak_idx": None,
+             "segments": None, "quality": None}
+        error = None
+        try:
+            # peak + quality metrics in one pass; calibration separately so a
+            # rejected current still leaves the peak and quality on record
+            a = analyze_cv(V, I_uA, None, smooth_k=job.smooth_k, peak=job.peak, smooth=job.smooth,
+                           aggregate=job.aggregate, curr_range=job.curr_range)
+            if a["peak_idx"] is None:
+                error = "No data captured."
+            else:
+                rejected = sorted(job.reject_flags.intersection(a["quality"]["flags"]))
+                if rejected:
+                    error = "Poor signal: " + ", ".join(rejected)
+                else:
+                    a["conc"] = job.calibrator.apply(a["Ip_uA"])
+        except Exception as e:
+            error = str(e)
+
+        # raw sweeps are kept even when the analysis fails, for re-analysis later
+        run_id = self._archive_run(job, t, V, I_uA, a, error)
+        if error is not None:
+            self._fail(job, error)
+            return
+
+        conc = a["conc"]
+        # the calibration this job was analysed with, not whatever is current by the time on_done runs
+        result = {"device_id": job.device_id, "t": t, "V": V, "I_uA": I_uA, "run_id": run_id,
+                  "calibration_id": getattr(job.calibrator, "digest", None)}
+        result.update(a)
+        job.state = "done"
+        with self._lock:
+            st = self._status[job.device_id]
+            st["completed"] += 1
+            st["last_conc"] = conc
+            st["last_error"] = None
+            if st["state"] == "analyzing":
+                st["state"] = "idle"
+        if job.on_done is not None:
+            self.dispatch(job.on_done, job, result)
+
+    def _archive_run(self, job, t, V, I_uA, a, error):
+        if self.archive is None or t.size == 0:
+            return None
+        meta = {
+            "device_id": job.device_id, "test": job.name, "params": job.params,
+            "curr_range": job.curr_range, "sample_period_ms": job.sample_period_ms,
+            "smooth_k": job.smooth_k, "peak": job.peak,
+            "smooth": None if callable(job.smooth) else job.smooth,
+            "aggregate": job.aggregate,
+            "calibration": job.calibrator.to_config() if job.calibrator is not None else None,
+            "calibration_sha256": getattr(job.calibrator, "digest", None),
+            "conc": a["conc"], "Ip_uA": a["Ip_uA"], "Vp_mV": a["Vp_mV"], "peak_idx": a["peak_idx"],
+            "quality": a["quality"], "error": error,
+        }
+        try:
+            return self.archive.append(t, V, I_uA, meta)
+        except Exception as e:
+            print("Could not archive CV run:", e)
+            return None
+
+    def _finish_cancelled(self, job):
+        if job.state == "timed_out":
+            msg = f"Measurement timed out after {job.timeout_s:g} s"
+        else:
+            job.state = "cancelled"
+            msg = "Measurement cancelled"
+        job.error = msg
+        with self._lock:
+            st = self._status[job.device_id]
+            st["cancelled"] += 1
+            st["last_error"] = msg
+            if job.device_id not in self._running:
+                st["state"] = "error" if job.state == "timed_out" else "idle"
+        if job.on_error is not None:
+            self.dispatch(job.on_error, job, msg)
+
+    def _fail(self, job, msg):
+        job.state = "failed"
+        job.error = msg
+        with self._lock:
+            st = self._status[job.device_id]
+            st["failed"] += 1
+            st["last_error"] = msg
+            st["state"] = "error"
+        if job.on_error is not None:
+            self.dispatch(job.on_error, job, msg)
+
+
+_scheduler = None
+
+def _default_dispatch():
+    # in the app, callbacks run on the Kivy thread; without Kivy, on the worker thread
+    try:
+        from ui_dispatch import get_dispatcher
+    except ImportError:
+        return _call_direct
+    return get_dispatcher().post
+
+def get_scheduler() -> MeasurementScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = MeasurementScheduler(dispatch=_default_dispatch(), archive=get_archive())
+    return _scheduler
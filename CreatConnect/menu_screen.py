@@ -11,9 +11,9 @@ from kivy.app import App
 from kivy.clock import Clock
 from kivy.properties import StringProperty 
 from kivy.core.text import Label as CoreLabel
-import time
+import os, time
 from graph import CreatinineGraph
-from port_finder_rodeo import find_rodeostat_port_by_device_id
+from data_storage import get_store
 
 
 # Constants
@@ -36,12 +36,15 @@ STATUS_HIGHLIGHT_NONE_COLOR = (0, 0, 0, 0)  # Transparent
 SKETCH_LINE_WIDTH = 2
 
 # === Data source switch for your team ===
-DATA_SOURCE = "potentiostat"   # or "simulation"
+DATA_SOURCE = "potentiostat"   # or "simulated_pstat" (pstat_sim, no hardware) or "simulation"
+SIM_CONCENTRATION_MG_DL = 1.0  # what the simulated potentiostat "measures"
 
 # === Potentiostat CV config ===
 RODEO_DEVICE_ID = 42           # the number you set in Step 1
+RODEO_DEVICE_IDS = [RODEO_DEVICE_ID]   # every bench device to measure on "Read Sensor"
 PSTAT_CURR_RANGE = "100uA"
 PSTAT_SAMPLE_PERIOD_MS = 10
+EXPORT_DIR = "exports"         # where "Share" writes readings + sweeps (data_exchange)
 PSTAT_PARAMS = {
     "quietValue": 0.0,
     "quietTime": 1000,
@@ -437,9 +440,8 @@ class MenuScreen(BoxLayout):
         app.sim_status = result["status"]
         app.sim_peak_signal = result["peak_signal"]
 
-        # ✅ Add the new creatinine value to the log
-        app.all_creatinine_readings.append(app.sim_creatinine)
-
+        # The reading itself is stored by the Sensor Graph screen once it is shown,
+        # so it is logged once, with the value that was plotted.
         # ✅ Schedule status update for menu screen immediately
         Clock.schedule_once(lambda dt: self.update_menu_status(), 0.1)
 
@@ -459,7 +461,7 @@ class MenuScreen(BoxLayout):
         app = App.get_running_app()
     
         # Clear readings
-        app.all_creatinine_readings.clear()
+        get_store().clear()
 
         # Reset labels and status color bar
         self.status_label.text = f"[b][color={SKETCH_COLOR_HEX}]Status:[/color][/b] . . ."
@@ -467,6 +469,7 @@ class MenuScreen(BoxLayout):
         self.status_bar.current_status_category = 'none'
         try:
             sensor_screen_widget = app.root.get_screen('sensor_graph_screen').children[0]
+            sensor_screen_widget.cancel_pstat_cv()
             sensor_screen_widget.graph.clear()
             sensor_screen_widget.status_label.text = "[b][color=000000]Status:[/color][/b] [b]--[/b]"
             sensor_screen_widget.creatinine_label.text = "[b][color=000000]Creatinine: -- mg/dL[/color][/b]"
@@ -487,16 +490,15 @@ class MenuScreen(BoxLayout):
         from sensor_input import load_health_info
         from personalization import get_status, get_breakdown
 
-        app = App.get_running_app()
-    
-        if not app.all_creatinine_readings:
+        last = get_store().last()
+        if last is None:
             # No data yet
             self.status_label.text = f"[b][color={SKETCH_COLOR_HEX}]Status:[/color][/b] [b]No Data Yet[/b]"
             self.breakdown_label.text = f"[color={SKETCH_COLOR_HEX}][b]Breakdown:[/b]\n• Data not yet available.\n• Read sensor for an update.[/color]"
             self.status_bar.current_status_category = 'none'
             return
 
-        latest_creatinine = app.all_creatinine_readings[-1]
+        latest_creatinine = last["conc_mg_dL"]
         print(f"MenuScreen: Updating status. Latest creatinine: {latest_creatinine:.2f}")
     
         # Load health info
@@ -567,22 +569,43 @@ class MenuScreen(BoxLayout):
         print("Contacting doctor (feature not implemented yet)")
 
     def share_with_doctor(self, instance):
-        print("Sharing with doctor (feature not implemented yet)")
+        """Export every reading and its sweep to a CSV pair in exports/, off the UI thread."""
+        import datetime, threading
+        from data_exchange import export
+        from ui_dispatch import get_dispatcher
+        path = os.path.join(EXPORT_DIR, f"CreatConnect_{datetime.datetime.now():%Y%m%d_%H%M%S}.csv")
+        self.breakdown_label.text = f"[color={SKETCH_COLOR_HEX}]Breakdown: exporting readings...[/color]"
+
+        def work():
+            try:
+                n = export(path)
+                msg = f"Breakdown: {n} readings exported to {path}"
+            except Exception as e:
+                msg = f"Breakdown: export failed ({e})"
+            get_dispatcher().post(setattr, self.breakdown_label, "text",
+                                  f"[color={SKETCH_COLOR_HEX}]{msg}[/color]")
+
+        threading.Thread(target=work, name="share-export", daemon=True).start()
 
     def start_read_sensor(self, instance):
         app = App.get_running_app()
         app.root.current = 'sensor_graph_screen'
         sensor_ui = app.root.get_screen('sensor_graph_screen').children[0]
 
-        if DATA_SOURCE == "potentiostat":
+        if DATA_SOURCE in ("potentiostat", "simulated_pstat"):
             try:
-                port = find_rodeostat_port_by_device_id(RODEO_DEVICE_ID)
-                sensor_ui.start_pstat_cv(
-                    port=port,
+                # port lookup, connection and analysis happen off the UI thread
+                # (measurement_scheduler), one queue per device
+                started = sensor_ui.start_pstat_cv(
+                    device_ids=RODEO_DEVICE_IDS,
                     params=PSTAT_PARAMS,
                     curr_range=PSTAT_CURR_RANGE,
-                    sample_period_ms=PSTAT_SAMPLE_PERIOD_MS
+                    sample_period_ms=PSTAT_SAMPLE_PERIOD_MS,
+                    source=DATA_SOURCE
                 )
+                if not started:
+                    self.status_label.text = f"[b][color={SKETCH_COLOR_HEX}]Status:[/color][/b] [b]Measurement already running[/b]"
+                    return
                 self.status_bar.current_status_category = 'none'
                 self.status_label.text = f"[b][color={SKETCH_COLOR_HEX}]Status:[/color][/b] [b]Running CV...[/b]"
                 self.breakdown_label.text = f"[color={SKETCH_COLOR_HEX}]Breakdown: potentiostat test in progress.[/color]"
@@ -1,17 +1,202 @@
 # port_finder_rodeo.py
-from serial.tools import list_ports
-from potentiostat import Potentiostat
+import json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pstat_driver import hardware_factory
 
-def find_rodeostat_port_by_device_id(target_id: int) -> str:
-    """Return COM path for the Rodeostat with this device_id (e.g., 'COM5' or '/dev/ttyACM0')."""
-    for info in list_ports.comports():
+PORT_CACHE_FILE = "rodeostat_ports.json"
+PROBE_TIMEOUT_S = 2.0      # hard limit for one port to answer get_device_id
+WATCH_INTERVAL_S = 2.0     # how often the USB watcher polls the port list
+
+def _comports():
+    # pyserial comes with the hardware stack; imported here so the simulator doesn't need it
+    from serial.tools import list_ports
+    return list_ports.comports()
+
+def probe_device_id(port: str, timeout: float = PROBE_TIMEOUT_S, factory=hardware_factory) -> int:
+    """Open `port`, ask for its device_id and close it again."""
+    p = factory(port, timeout=timeout)
+    try:
+        return int(p.get_device_id())
+    finally:
         try:
-            p = Potentiostat(info.device)
-            did = int(p.get_device_id())
             p.close()
-            if did == int(target_id):
-                return info.device
         except Exception:
-            # Not a Rodeostat or busy: ignore and continue scanning
             pass
-    raise RuntimeError(f"No Rodeostat with device_id={target_id} found.")
+
+class PortDiscovery:
+    """
+    device_id -> port lookup for Rodeostats.
+
+    - a persistent cache (PORT_CACHE_FILE) checked with a single probe first
+    - the remaining ports probed in parallel, each with a hard timeout
+    - an optional watcher thread that re-probes when USB ports come and go
+    """
+    def __init__(self, cache_path=PORT_CACHE_FILE, probe_timeout=PROBE_TIMEOUT_S,
+                 max_workers=8, factory=hardware_factory):
+        self.cache_path = cache_path
+        self.probe_timeout = float(probe_timeout)
+        self.max_workers = int(max_workers)
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._cache = self._load_cache()     # {device_id: port}
+        self._watch_stop = None
+        self._known_ports = set()
+        self._port_locks = {}                # port -> Lock; one probe per port at a time
+
+    # --- cache ---
+    def _load_cache(self):
+        try:
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, "r") as f:
+                    return {int(k): v for k, v in json.load(f).items()}
+        except Exception as e:
+            print("Could not read port cache:", e)
+        return {}
+
+    def _save_cache(self):
+        try:
+            with open(self.cache_path, "w") as f:
+                json.dump({str(k): v for k, v in self._cache.items()}, f)
+        except Exception as e:
+            print("Could not write port cache:", e)
+
+    def _remember(self, found: dict):
+        with self._lock:
+            changed = False
+            for did, port in found.items():
+                # a port belongs to at most one device
+                for old in [d for d, p in self._cache.items() if p == port and d != did]:
+                    del self._cache[old]
+                    changed = True
+                if self._cache.get(did) != port:
+                    self._cache[did] = port
+                    changed = True
+            if changed:
+                self._save_cache()
+
+    def _forget(self, ports):
+        with self._lock:
+            stale = [d for d, p in self._cache.items() if p in ports]
+            for d in stale:
+                del self._cache[d]
+            if stale:
+                self._save_cache()
+
+    def cached_port(self, device_id):
+        with self._lock:
+            return self._cache.get(int(device_id))
+
+    # --- probing ---
+    def _probe(self, port):
+        # find() and the watcher may reach the same port; a serial port takes one opener
+        with self._lock:
+            lock = self._port_locks.setdefault(port, threading.Lock())
+        if not lock.acquire(timeout=self.probe_timeout):
+            raise TimeoutError(f"{port} is being probed already")
+        try:
+            return probe_device_id(port, self.probe_timeout, self._factory)
+        finally:
+            lock.release()
+
+    def probe_ports(self, ports, stop_on=None) -> dict:
+        """
+        Probe `ports` concurrently and return {device_id: port} for the ones
+        that answered within probe_timeout. Returns early once `stop_on` is found.
+        Ports that hang are abandoned, not waited for.
+        """
+        ports = list(ports)
+        found = {}
+        if not ports:
+            return found
+        pool = ThreadPoolExecutor(max_workers=min(len(ports), self.max_workers),
+                                  thread_name_prefix="rodeo-probe")
+        try:
+            pending = {pool.submit(self._probe, port): port for port in ports}
+            # with more ports than workers the probes run in rounds
+            rounds = -(-len(ports) // self.max_workers)
+            deadline = self.probe_timeout * rounds
+            while pending and deadline > 0:
+                t0 = time.monotonic()
+                done, _ = wait(pending, timeout=deadline, return_when=FIRST_COMPLETED)
+                deadline -= time.monotonic() - t0
+                for fut in done:
+                    port = pending.pop(fut)
+                    try:
+                        found[fut.result()] = port
+                    except Exception:
+                        pass   # not a Rodeostat, or busy
+                if stop_on is not None and int(stop_on) in found:
+                    break
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._remember(found)
+        return found
+
+    def find(self, target_id: int, exclude=()) -> str:
+        """Return the port for `target_id`; ports in `exclude` (already open) are not probed."""
+        target_id = int(target_id)
+        ports = [info.device for info in _comports() if info.device not in exclude]
+
+        cached = self.cached_port(target_id)
+        if cached in ports:
+            try:
+                if self._probe(cached) == target_id:
+                    return cached
+            except Exception:
+                pass
+            self._forget([cached])
+            ports.remove(cached)
+
+        found = self.probe_ports(ports, stop_on=target_id)
+        if target_id in found:
+            return found[target_id]
+        raise RuntimeError(f"No Rodeostat with device_id={target_id} found.")
+
+    # --- background refresh ---
+    def start_watching(self, interval=WATCH_INTERVAL_S, exclude=lambda: ()):
+        """Re-probe added ports and drop removed ones in a daemon thread.
+
+        Ports present when watching starts are taken as known, not probed:
+        find() already covers them on demand.
+        """
+        if self._watch_stop is not None:
+            return
+        self._watch_stop = stop = threading.Event()
+        try:
+            self._known_ports = {info.device for info in _comports()}
+        except Exception as e:
+            print("Port watcher error:", e)
+
+        def loop():
+            while not stop.is_set():
+                try:
+                    self._refresh(exclude())
+                except Exception as e:
+                    print("Port watcher error:", e)
+                stop.wait(interval)
+
+        threading.Thread(target=loop, name="rodeo-port-watch", daemon=True).start()
+
+    def stop_watching(self):
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
+
+    def _refresh(self, exclude=()):
+        current = {info.device for info in _comports()}
+        added, removed = current - self._known_ports, self._known_ports - current
+        self._known_ports = current
+        if removed:
+            self._forget(removed)
+        added = [p for p in added if p not in exclude]
+        if added:
+            self.probe_ports(added)
+
+_discovery = PortDiscovery()
+
+def get_discovery() -> PortDiscovery:
+    return _discovery
+
+def find_rodeostat_port_by_device_id(target_id: int, exclude=()) -> str:
+    """Return COM path for the Rodeostat with this device_id (e.g., 'COM5' or '/dev/ttyACM0')."""
+    return _discovery.find(target_id, exclude=exclude)
@@ -1,5 +1,15 @@
 # pstat_driver.py
-from potentiostat import Potentiostat
+import json
+
+def hardware_factory(port, **kwargs):
+    """Open a real Rodeostat. The iorodeo `potentiostat` package is imported on
+    first use, so the simulator (pstat_sim) runs without it installed."""
+    from potentiostat import Potentiostat
+    return Potentiostat(port, **kwargs)
+
+# Wire-protocol keys used by the Rodeostat firmware (same as potentiostat.run_test)
+_TIME_KEY, _VOLT_KEY, _CURR_KEY = "t", "v", "i"
+_TIME_SCALE = {"s": 1.0e-3, "ms": 1.0}
 
 def run_cv_blocking(
     port: str,
@@ -8,9 +18,10 @@ def run_cv_blocking(
     sample_period_ms: int = 10,
     name: str = "cyclic",
     show_progress: bool = True,
+    factory=hardware_factory,
 ):
     """Run a CV test and return (t, volt, curr)."""
-    dev = Potentiostat(port)
+    dev = factory(port)
     try:
         dev.set_curr_range(curr_range)
         dev.set_sample_period(sample_period_ms)
@@ -22,3 +33,74 @@ def run_cv_blocking(
             dev.close()
         except Exception:
             pass
+
+def run_cv_stream(
+    port: str,
+    params: dict,
+    curr_range: str = "100uA",
+    sample_period_ms: int = 10,
+    name: str = "cyclic",
+    chunk_size: int = 10,
+    on_chunk=None,
+    factory=hardware_factory,
+):
+    """
+    Run a CV test and yield (t, volt, curr) lists of up to chunk_size samples
+    as they arrive from the device, instead of waiting for the whole sweep.
+    If on_chunk is given it is also called with every chunk.
+    factory builds the device (e.g. pstat_sim.simulator_factory()).
+    """
+    dev = factory(port)
+    try:
+        dev.set_curr_range(curr_range)
+        dev.set_sample_period(sample_period_ms)
+        dev.set_param(name, params)
+        for chunk in stream_test(dev, name, chunk_size=chunk_size):
+            if on_chunk is not None:
+                on_chunk(*chunk)
+            yield chunk
+    finally:
+        try:
+            dev.close()
+        except Exception:
+            pass
+
+def stream_test(dev, name: str = "cyclic", chunk_size: int = 10, timeunit: str = "s"):
+    """
+    Start test `name` on an already-configured device and yield (t, volt, curr)
+    chunks while it runs. Mirrors the read loop of Potentiostat.run_test: one JSON
+    sample per line, an empty object marks the end of the test.
+    If the consumer stops early the test is stopped on the device.
+    """
+    scale = _TIME_SCALE[timeunit]
+    chunk_size = max(1, int(chunk_size))
+    t, volt, curr = [], [], []
+    done = False
+
+    dev.send_cmd({"command": "runTest", "test": name})
+    try:
+        while not done:
+            line = dev.readline().strip()
+            if not line:
+                continue
+            try:
+                sample = json.loads(line.decode() if isinstance(line, bytes) else line)
+            except ValueError:
+                continue   # partial/garbled line, same as run_test
+
+            if sample:
+                t.append(sample[_TIME_KEY] * scale)
+                volt.append(sample[_VOLT_KEY])
+                curr.append(sample[_CURR_KEY])
+            else:
+                done = True
+
+            if t and (done or len(t) >= chunk_size):
+                yield t, volt, curr
+                t, volt, curr = [], [], []
+    finally:
+        if not done:
+            try:
+                dev.stop_test()
+            except Exception:
+                pass
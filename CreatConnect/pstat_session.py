@@ -0,0 +1,164 @@
+# pstat_session.py
+"""
+pstat_session.py - Long-lived Rodeostat connections keyed by device id.
+
+Opening the serial port, probing for the device and re-sending the same
+current range / sample period / test params on every measurement costs more
+than the analysis itself. A PstatSession keeps the Potentiostat open between
+runs, only sends settings that changed, and reconnects (re-resolving the port)
+when the link drops.
+"""
+import threading
+from port_finder_rodeo import find_rodeostat_port_by_device_id
+from pstat_driver import stream_test, hardware_factory
+
+class PstatSession:
+    def __init__(self, device_id, factory=hardware_factory,
+                 resolve_port=find_rodeostat_port_by_device_id, retries=1):
+        self.device_id = int(device_id)
+        self.port = None
+        self.retries = int(retries)
+        self._factory = factory
+        self._resolve_port = resolve_port
+        self._dev = None
+        self._settings = {}            # last values actually sent to the device
+        self._lock = threading.Lock()  # one test at a time per device
+        self._aborted = False
+
+    @property
+    def connected(self):
+        return self._dev is not None
+
+    def _connect(self):
+        if self._dev is None:
+            if self.port is None:
+                self.port = self._resolve_port(self.device_id)
+            self._dev = self._factory(self.port)
+            self._settings = {}
+        return self._dev
+
+    def _drop(self, forget_port=False):
+        dev, self._dev = self._dev, None
+        self._settings = {}
+        if forget_port:
+            self.port = None   # device may have re-enumerated on another port
+        if dev is not None:
+            try:
+                dev.close()
+            except Exception:
+                pass
+
+    def _configure(self, curr_range, sample_period_ms, name, params):
+        dev = self._connect()
+        if self._settings.get("curr_range") != curr_range:
+            dev.set_curr_range(curr_range)
+            self._settings["curr_range"] = curr_range
+        if self._settings.get("sample_period_ms") != sample_period_ms:
+            dev.set_sample_period(sample_period_ms)
+            self._settings["sample_period_ms"] = sample_period_ms
+        key = ("param", name)
+        if self._settings.get(key) != params:
+            dev.set_param(name, params)
+            self._settings[key] = dict(params)
+        return dev
+
+    def run_cv_stream(self, params, curr_range="100uA", sample_period_ms=10,
+                      name="cyclic", chunk_size=10):
+        """
+        Same chunks as pstat_driver.run_cv_stream, over the held connection.
+        Failures before the first sample are retried on a fresh connection;
+        once data has been handed out the error is raised after dropping the
+        connection, so the next run reconnects.
+        """
+        with self._lock:
+            self._aborted = False
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    dev = self._configure(curr_range, sample_period_ms, name, params)
+                    for chunk in stream_test(dev, name, chunk_size=chunk_size):
+                        started = True
+                        yield chunk
+                    return
+                except GeneratorExit:
+                    raise
+                except Exception:
+                    if self._aborted:
+                        raise
+                    self._drop(forget_port=True)
+                    if started or attempt >= self.retries:
+                        raise
+                    attempt += 1
+
+    def run_cv_blocking(self, params, curr_range="100uA", sample_period_ms=10, name="cyclic"):
+        """Run a CV test over the held connection and return (t, volt, curr)."""
+        t, volt, curr = [], [], []
+        for t_c, v_c, i_c in self.run_cv_stream(params, curr_range, sample_period_ms, name,
+                                               chunk_size=256):
+            t.extend(t_c)
+            volt.extend(v_c)
+            curr.extend(i_c)
+        return t, volt, curr
+
+    def abort(self):
+        """
+        Close the connection from another thread to unblock a hung test.
+        The run in progress raises instead of retrying; the next run reconnects.
+        """
+        self._aborted = True
+        self._drop()
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+
+class SessionManager:
+    """Hands out one PstatSession per device id. resolve_port(device_id, exclude=...) -> port."""
+    def __init__(self, factory=hardware_factory, resolve_port=find_rodeostat_port_by_device_id):
+        self._factory = factory
+        self._resolve_port = resolve_port
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, device_id):
+        # never probe a port another session is holding open
+        return self._resolve_port(device_id, exclude=self.ports_in_use())
+
+    def ports_in_use(self):
+        with self._lock:
+            return {s.port for s in self._sessions.values() if s.connected}
+
+    def get(self, device_id) -> PstatSession:
+        device_id = int(device_id)
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is None:
+                session = PstatSession(device_id, self._factory, self._resolve)
+                self._sessions[device_id] = session
+            return session
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+_manager = SessionManager()
+
+def get_session(device_id) -> PstatSession:
+    return _manager.get(device_id)
+
+def ports_in_use():
+    return _manager.ports_in_use()
+
+def close_all_sessions():
+    _manager.close_all()
+
+def set_backend(factory, resolve_port):
+    """Swap the device backend (e.g. pstat_sim) for all future sessions."""
+    global _manager
+    old, _manager = _manager, SessionManager(factory, resolve_port)
+    old.close_all()
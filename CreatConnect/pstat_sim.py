@@ -0,0 +1,225 @@
+# pstat_sim.py
+"""
+pstat_sim.py - Software stand-in for the Rodeostat `potentiostat.Potentiostat`.
+
+SimulatedPotentiostat has the same set_curr_range / set_sample_period /
+set_param / run_test / get_device_id surface, plus the send_cmd / readline
+wire protocol that pstat_driver.stream_test reads, so the real
+acquisition -> calibration path runs with no hardware attached.
+
+Curves are a triangle-wave cyclic sweep (same params as PSTAT_PARAMS) with
+- double-layer charging current  C_dl * dV/dt
+- a reduction peak on the cathodic sweep and a smaller oxidation peak on the
+  anodic sweep, both with a diffusion tail
+- peak height following a saturating (Langmuir) response to concentration,
+  scaled by sqrt(scan rate) as in Randles-Sevcik
+- gaussian noise, and clipping at the selected current range
+"""
+import json, time
+import numpy as np
+
+CURR_RANGES_UA = {"1uA": 1.0, "10uA": 10.0, "100uA": 100.0, "1000uA": 1000.0}
+SIM_PORT_PREFIX = "sim://"
+
+# response model, roughly matching simulated_data/*_Creatinine_*mgdL.csv
+IMAX_UA = 6.5              # saturation peak current
+K_MG_DL = 0.55             # half-saturation concentration
+REF_SCAN_RATE_V_S = 1.6    # scan rate the response above was taken at
+E_RED_V = -0.15            # reduction peak potential
+E_OX_V = 0.10              # oxidation peak potential
+PEAK_WIDTH_V = 0.05
+OX_RATIO = 0.8             # oxidation / reduction peak height
+C_DL_UF = 0.5              # double-layer capacitance (µF) -> µA per V/s
+
+def peak_current_uA(concentration_mg_dL, scan_rate_v_s=REF_SCAN_RATE_V_S):
+    """Magnitude of the reduction peak for a given concentration."""
+    c = max(float(concentration_mg_dL), 0.0)
+    return IMAX_UA * c / (K_MG_DL + c) * np.sqrt(max(scan_rate_v_s, 1e-9) / REF_SCAN_RATE_V_S)
+
+def _raw_peak_shape(x):
+    # rises like a sigmoid, peaks, then decays ~ x^-1/2 (diffusion limited)
+    rise = 1.0 / (1.0 + np.exp(-x))
+    tail = 1.0 / np.sqrt(1.0 + np.maximum(x, 0.0))
+    return rise * tail
+
+_SHAPE_MAX = float(np.max(_raw_peak_shape(np.linspace(-5.0, 20.0, 5001))))
+
+def _peak_shape(x):
+    return _raw_peak_shape(x) / _SHAPE_MAX    # unit height
+
+def cv_curve(params, sample_period_ms=10, concentration_mg_dL=1.0, noise_uA=0.05,
+             curr_range="100uA", rng=None):
+    """
+    Generate one cyclic-voltammetry run.
+    Returns (t_ms, volt, curr_uA) float arrays, quiet period included.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    dt = float(sample_period_ms)
+    quiet_ms = float(params.get("quietTime", 0))
+    period = float(params.get("period", 1000))
+    amp = float(params.get("amplitude", 0.0))
+    offset = float(params.get("offset", 0.0))
+    shift = float(params.get("shift", 0.0))
+    cycles = int(params.get("numCycles", 1))
+
+    n_quiet = int(round(quiet_ms / dt))
+    n_sweep = int(round(cycles * period / dt))
+    t = np.arange(n_quiet + n_sweep, dtype=float) * dt
+
+    # triangle wave: 0 -> +1 at 1/4 period -> -1 at 3/4 -> 0
+    phase = (t[n_quiet:] - quiet_ms) / period + shift
+    tri = 4.0 * np.abs(np.mod(phase - 0.25, 1.0) - 0.5) - 1.0
+    volt = np.empty_like(t)
+    volt[:n_quiet] = float(params.get("quietValue", 0.0))
+    volt[n_quiet:] = offset + amp * tri
+
+    dvdt = np.gradient(volt, dt * 1e-3) if volt.size > 1 else np.zeros_like(volt)
+    dvdt[:n_quiet] = 0.0
+    scan_rate = 4.0 * abs(amp) / (period * 1e-3) if period > 0 else 0.0
+    ip = peak_current_uA(concentration_mg_dL, scan_rate)
+
+    cathodic, anodic = dvdt < 0, dvdt > 0
+    curr = C_DL_UF * dvdt
+    curr -= cathodic * ip * _peak_shape((E_RED_V - volt) / PEAK_WIDTH_V + 1.0)
+    curr += anodic * OX_RATIO * ip * _peak_shape((volt - E_OX_V) / PEAK_WIDTH_V + 1.0)
+    if noise_uA > 0:
+        curr += rng.normal(0.0, noise_uA, curr.shape)
+
+    limit = CURR_RANGES_UA.get(curr_range, 100.0)
+    return t, volt, np.clip(curr, -limit, limit)
+
+
+class SimulatedPotentiostat:
+    """
+    Drop-in fake of potentiostat.Potentiostat.
+
+    concentration_mg_dL / noise_uA shape the curve; latency_s is added to every
+    command round trip; time_scale=1.0 streams samples in real time, 0 as fast
+    as possible.
+    """
+    def __init__(self, port=SIM_PORT_PREFIX + "42", timeout=10.0, device_id=None,
+                 concentration_mg_dL=1.0, noise_uA=0.05, latency_s=0.0, time_scale=1.0,
+                 seed=None):
+        self.port = port
+        self.timeout = timeout
+        if device_id is None:
+            tail = str(port).rsplit("/", 1)[-1]
+            device_id = int(tail) if tail.isdigit() else 0
+        self.device_id = int(device_id)
+        self.concentration_mg_dL = float(concentration_mg_dL)
+        self.noise_uA = float(noise_uA)
+        self.latency_s = float(latency_s)
+        self.time_scale = float(time_scale)
+        self._rng = np.random.default_rng(seed)
+        self._curr_range = "100uA"
+        self._sample_period_ms = 10
+        self._params = {}
+        self._lines = None
+        self._line_idx = 0
+        self._t_start = None
+        self.is_open = True
+
+    # --- command surface ---
+    def _roundtrip(self):
+        if not self.is_open:
+            raise IOError(f"Simulated port {self.port} is closed")
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+
+    def get_device_id(self):
+        self._roundtrip()
+        return self.device_id
+
+    def set_curr_range(self, curr_range):
+        self._roundtrip()
+        if curr_range not in CURR_RANGES_UA:
+            raise ValueError(f"Unknown current range {curr_range}")
+        self._curr_range = curr_range
+
+    def get_curr_range(self):
+        return self._curr_range
+
+    def set_sample_period(self, sample_period_ms):
+        self._roundtrip()
+        self._sample_period_ms = int(sample_period_ms)
+
+    def get_sample_period(self):
+        return self._sample_period_ms
+
+    def set_param(self, name, params):
+        self._roundtrip()
+        self._params[name] = dict(params)
+
+    def get_param(self, name):
+        return dict(self._params.get(name, {}))
+
+    def get_test_done_time(self, name, timeunit="ms"):
+        p = self._params.get(name, {})
+        ms = float(p.get("quietTime", 0)) + float(p.get("period", 0)) * int(p.get("numCycles", 1))
+        return ms * (1e-3 if timeunit == "s" else 1.0)
+
+    def _make_curve(self, name):
+        return cv_curve(self._params.get(name, {}), self._sample_period_ms,
+                        self.concentration_mg_dL, self.noise_uA, self._curr_range, self._rng)
+
+    def run_test(self, name, param=None, filename=None, display="pbar", timeunit="s"):
+        if param is not None:
+            self.set_param(name, param)
+        self._roundtrip()
+        t, volt, curr = self._make_curve(name)
+        if self.time_scale > 0:
+            time.sleep(t[-1] * 1e-3 * self.time_scale if t.size else 0.0)
+        scale = 1e-3 if timeunit == "s" else 1.0
+        return (t * scale).tolist(), volt.tolist(), curr.tolist()
+
+    def stop_test(self):
+        self._lines = None
+
+    def close(self):
+        self._lines = None
+        self.is_open = False
+
+    # --- wire protocol used by pstat_driver.stream_test ---
+    def send_cmd(self, cmd):
+        self._roundtrip()
+        if cmd.get("command") == "runTest":
+            t, volt, curr = self._make_curve(cmd.get("test", "cyclic"))
+            self._lines = [json.dumps({"t": a, "v": b, "i": c}).encode() + b"\n"
+                           for a, b, c in zip(t.tolist(), volt.tolist(), curr.tolist())]
+            self._lines.append(b"{}\n")
+            self._line_idx = 0
+            self._t_start = time.monotonic()
+        elif cmd.get("command") == "stopTest":
+            self.stop_test()
+        return {"success": True}
+
+    def readline(self):
+        if not self.is_open:
+            raise IOError(f"Simulated port {self.port} is closed")
+        if not self._lines or self._line_idx >= len(self._lines):
+            return b""
+        if self.time_scale > 0:
+            # hold each sample back until the simulated instrument would have taken it
+            due = self._t_start + self._line_idx * self._sample_period_ms * 1e-3 * self.time_scale
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        line = self._lines[self._line_idx]
+        self._line_idx += 1
+        return line
+
+
+def simulator_factory(**options):
+    """Factory with the Potentiostat(port, timeout=...) signature, for PstatSession etc."""
+    def factory(port, timeout=10.0):
+        return SimulatedPotentiostat(port, timeout=timeout, **options)
+    return factory
+
+def simulator_port(device_id, exclude=()):
+    """resolve_port stand-in: simulated devices live at sim://<device_id>."""
+    return f"{SIM_PORT_PREFIX}{int(device_id)}"
+
+def install(**options):
+    """Route every PstatSession through simulated devices."""
+    from pstat_session import set_backend
+    set_backend(simulator_factory(**options), simulator_port)
@@ -1,20 +1,29 @@
 import numpy as np
+from smoothing import boxcar, make_smoother, parse_spec
 
 def movavg(x, k=5):
-    if k <= 1 or len(x) < 3:
-        return np.asarray(x, dtype=float)
-    return np.convolve(x, np.ones(k)/k, mode="same")
+    # centred boxcar, windows shrink at the sweep ends (see smoothing.py)
+    return boxcar(x, k)
 
-def concentration_from_cv(V_volts, I_uA, calibrator, smooth_k=5, peak="reduction"):
+def to_microamps(I):
+    # Units: many APIs return Amps. Convert to µA if values are small.
+    I = np.asarray(I, dtype=float)
+    if I.size and np.nanmax(np.abs(I)) < 1e-3:
+        return I * 1e6
+    return I  # already in µA
+
+def find_peak(V_volts, I_uA, smooth_k=5, peak="reduction", smooth=None):
     """
-    peak: 'reduction' (most negative), 'oxidation' (most positive), or 'abs' (largest magnitude)
-    Returns: (conc_out, Ip_uA, Vp_mV, peak_idx)
+    Smoothed peak of one sweep, without calibration.
+    Returns: (Ip_uA, Vp_mV, peak_idx), or Nones for an empty sweep
     """
     if len(V_volts) == 0 or len(I_uA) == 0:
-        return None, None, None, None
+        return None, None, None
 
-    I_s = movavg(I_uA, k=smooth_k)
+    I_s = make_smoother(smooth, smooth_k)(I_uA)
+    return _peak_of(V_volts, I_s, peak)
 
+def _peak_of(V_volts, I_s, peak):
     if peak == "reduction":
         peak_idx = int(np.argmin(I_s))          # <-- most negative current
     elif peak == "oxidation":
@@ -24,9 +33,436 @@ def concentration_from_cv(V_volts, I_uA, calibrator, smooth_k=5, peak="reduction
 
     Ip_uA = float(I_s[peak_idx])
     Vp_mV = float(V_volts[peak_idx] * 1000.0)
+    return Ip_uA, Vp_mV, peak_idx
+
+def concentration_from_cv(V_volts, I_uA, calibrator, smooth_k=5, peak="reduction", smooth=None):
+    """
+    peak: 'reduction' (most negative), 'oxidation' (most positive), or 'abs' (largest magnitude)
+    smooth: smoothing spec (see smoothing.py); default is a boxcar of width smooth_k
+    Returns: (conc_out, Ip_uA, Vp_mV, peak_idx)
+    """
+    Ip_uA, Vp_mV, peak_idx = find_peak(V_volts, I_uA, smooth_k, peak, smooth)
+    if peak_idx is None:
+        return None, None, None, None
 
     # calibrator already converts to target unit (mg/dL) if configured
     conc_out = calibrator.apply(Ip_uA)
     return conc_out, Ip_uA, Vp_mV, peak_idx
 
 
+def _as_batch(X):
+    """2-D float array (padded with 0) + per-row lengths, from a 2-D array or ragged sweeps."""
+    if isinstance(X, np.ndarray) and X.ndim == 2:
+        X = X.astype(float, copy=False)
+        return X, np.full(X.shape[0], X.shape[1], dtype=np.intp)
+    rows = [np.asarray(r, dtype=float).ravel() for r in X]
+    lengths = np.array([r.size for r in rows], dtype=np.intp)
+    out = np.zeros((len(rows), int(lengths.max()) if rows else 0))
+    for i, r in enumerate(rows):
+        out[i, :r.size] = r
+    return out, lengths
+
+def movavg_batch(X, lengths, k=5):
+    """
+    Row-wise movavg of a padded 2-D array (one cumulative sum over the batch);
+    windows shrink at both ends of every row, as in movavg.
+    """
+    X = np.asarray(X, dtype=float)
+    if k <= 1 or X.size == 0:
+        return X.copy()
+    n_rows, n_cols = X.shape
+    # window for column j is x[j - k//2 .. j + (k-1)//2], clipped to the row
+    cols = np.arange(n_cols)
+    valid = cols[None, :] < lengths[:, None]
+    c = np.zeros((n_rows, n_cols + 1))
+    np.cumsum(np.where(valid, X, 0.0), axis=1, out=c[:, 1:])
+    lo = np.maximum(cols - k // 2, 0)[None, :]
+    hi = np.minimum(cols[None, :] + (k - 1) // 2, np.maximum(lengths[:, None] - 1, 0)) + 1
+    hi = np.maximum(hi, lo + 1)
+    rows = np.arange(n_rows)[:, None]
+    return (c[rows, hi] - c[rows, lo]) / (hi - lo)
+
+def _smooth_batch(I, lengths, smooth, smooth_k):
+    kind, options = parse_spec(smooth, smooth_k)
+    if kind == "boxcar":
+        return movavg_batch(I, lengths, k=options["window"])
+    # other filters have no batched form; run them per row
+    smoother = make_smoother(smooth, smooth_k)
+    out = I.copy()
+    for r, n in enumerate(lengths):
+        out[r, :n] = smoother(I[r, :n])
+    return out
+
+def concentration_from_cv_batch(V_volts, I_uA, calibrator, smooth_k=5, peak="reduction", smooth=None):
+    """
+    concentration_from_cv over many sweeps at once.
+    V_volts / I_uA: 2-D arrays (one sweep per row) or lists of ragged sweeps.
+    Returns (conc, Ip_uA, Vp_mV, peak_idx) arrays, one entry per sweep. Empty
+    sweeps get peak_idx -1 and NaN values; conc is NaN where the calibrator
+    rejects the peak current.
+    """
+    V, _ = _as_batch(V_volts)
+    I, lengths = _as_batch(I_uA)
+    n = I.shape[0]
+    conc = np.full(n, np.nan)
+    Ip = np.full(n, np.nan)
+    Vp_mV = np.full(n, np.nan)
+    peak_idx = np.full(n, -1, dtype=np.intp)
+    if n == 0 or I.shape[1] == 0:
+        return conc, Ip, Vp_mV, peak_idx
+
+    I_s = _smooth_batch(I, lengths, smooth, smooth_k)
+    valid = np.arange(I.shape[1])[None, :] < lengths[:, None]
+    if peak == "reduction":
+        idx = np.argmin(np.where(valid, I_s, np.inf), axis=1)
+    elif peak == "oxidation":
+        idx = np.argmax(np.where(valid, I_s, -np.inf), axis=1)
+    else:
+        idx = np.argmax(np.where(valid, np.abs(I_s), -np.inf), axis=1)
+
+    rows = np.nonzero(lengths > 0)[0]
+    peak_idx[rows] = idx[rows]
+    Ip[rows] = I_s[rows, idx[rows]]
+    Vp_mV[rows] = V[rows, idx[rows]] * 1000.0
+
+    conc[rows] = calibrator.apply_array(Ip[rows])[0]
+    return conc, Ip, Vp_mV, peak_idx
+
+
+class OnlinePeakDetector:
+    """
+    Incremental concentration_from_cv for streamed samples.
+
+    feed() takes chunks of (V, I_uA) as they arrive; the moving average and the
+    running extremum are updated per chunk with O(1) work per sample, so the
+    current best peak is available during the sweep. A smoothed value needs
+    (smooth_k-1)//2 samples of look-ahead, which finish() flushes with the same
+    shrinking end windows as movavg. After finish() the result equals
+    concentration_from_cv on the whole sweep. Only boxcar smoothing is supported.
+    """
+    def __init__(self, calibrator=None, smooth_k=5, peak="reduction", smooth=None):
+        kind, options = parse_spec(smooth, smooth_k)
+        if kind != "boxcar":
+            raise ValueError("OnlinePeakDetector only supports boxcar smoothing")
+        self.calibrator = calibrator
+        self.smooth_k = options["window"]
+        self.peak = peak
+        self.reset()
+
+    def reset(self):
+        self.k = max(1, int(self.smooth_k))
+        self.n = 0                           # samples fed
+        self.finished = False
+        self._n_out = 0                      # samples smoothed so far
+        self._buf = np.empty(0)              # raw I from index max(_n_out - k//2, 0) on
+        self._vbuf = np.empty(0)             # V for indices _n_out .. n-1
+        self.peak_idx = None
+        self.Ip_uA = None
+        self.Vp_mV = None
+        self._score = None
+
+    def feed(self, V_chunk, I_chunk):
+        """Add a chunk of samples; returns self."""
+        if self.finished:
+            raise RuntimeError("OnlinePeakDetector.feed() after finish(); call reset() first")
+        I_chunk = np.asarray(I_chunk, dtype=float).ravel()
+        V_chunk = np.asarray(V_chunk, dtype=float).ravel()
+        if I_chunk.size != V_chunk.size:
+            raise ValueError("V and I chunks differ in length")
+        self._buf = np.concatenate([self._buf, I_chunk])
+        self._vbuf = np.concatenate([self._vbuf, V_chunk])
+        self.n += I_chunk.size
+        self._emit(self.n - (self.k - 1) // 2 - self._n_out)
+        return self
+
+    def finish(self):
+        """Flush the look-ahead at the end of the sweep; returns self."""
+        if self.finished:
+            return self
+        self.finished = True
+        self._emit(self.n - self._n_out)
+        return self
+
+    def _emit(self, m):
+        if m <= 0:
+            return
+        # window of index i is [i - k//2, i + (k-1)//2] clipped to the samples seen;
+        # _buf starts at index `base`, and before finish() the right edge is never clipped
+        left, right = self.k // 2, (self.k - 1) // 2
+        base = max(self._n_out - left, 0)
+        idx = self._n_out + np.arange(m)
+        lo = np.maximum(idx - left, 0) - base
+        hi = np.minimum(idx + right, self.n - 1) + 1 - base
+        c = np.concatenate([[0.0], np.cumsum(self._buf[:hi[-1]])])
+        smoothed = (c[hi] - c[lo]) / (hi - lo)
+        if self.peak == "reduction":
+            score = smoothed
+        elif self.peak == "oxidation":
+            score = -smoothed
+        else:
+            score = -np.abs(smoothed)
+        j = int(np.argmin(score))
+        # strict comparison keeps the first occurrence, like np.argmin on the whole sweep
+        if self._score is None or score[j] < self._score:
+            self._score = float(score[j])
+            self.peak_idx = self._n_out + j
+            self.Ip_uA = float(smoothed[j])
+            self.Vp_mV = float(self._vbuf[j] * 1000.0)
+        self._n_out += m
+        self._buf = self._buf[max(self._n_out - left, 0) - base:]
+        self._vbuf = self._vbuf[m:]
+
+    @property
+    def conc(self):
+        """Calibrated concentration of the current best peak (None if unavailable)."""
+        if self.Ip_uA is None or self.calibrator is None:
+            return None
+        try:
+            return self.calibrator.apply(self.Ip_uA)
+        except ValueError:
+            return None
+
+    def result(self):
+        """(conc_out, Ip_uA, Vp_mV, peak_idx) for the samples seen so far."""
+        return self.conc, self.Ip_uA, self.Vp_mV, self.peak_idx
+
+
+def _direction_runs(d):
+    # forward-fill zero directions, then return (start, stop, direction) of each run
+    last = np.maximum.accumulate(np.where(d != 0, np.arange(d.size), -1))
+    d = np.where(last >= 0, d[np.maximum(last, 0)], 0).astype(int)
+    change = np.flatnonzero(np.diff(d)) + 1
+    start = np.concatenate([[0], change])
+    stop = np.concatenate([change, [d.size]])
+    return start, stop, d[start]
+
+def segment_sweep(V_volts, min_points=3, min_span_frac=0.05):
+    """
+    Split a CV trace into half-sweeps by the sign of dV/dt.
+    V is boxcar-smoothed over min_points first, and runs covering less than
+    min_span_frac of the trace's voltage range are treated as flat, so noise
+    does not start new segments. Flat stretches continue the previous
+    direction, or are dropped when they lead the trace (quiet time).
+    Returns a dict of arrays, one entry per segment:
+        start, stop   sample range [start, stop)
+        direction     +1 anodic (V rising), -1 cathodic (V falling)
+        cycle         0-based; increments each time the first direction recurs
+        span_V        voltage range covered by the segment
+    """
+    V = np.asarray(V_volts, dtype=float)
+    empty = {"start": np.empty(0, dtype=np.intp), "stop": np.empty(0, dtype=np.intp),
+             "direction": np.empty(0, dtype=int), "cycle": np.empty(0, dtype=int),
+             "span_V": np.empty(0)}
+    if V.size < 2:
+        return empty
+    Vs = boxcar(V, min_points)
+    d = np.sign(np.diff(Vs))
+    d = np.append(d, d[-1])                       # one direction per sample
+
+    def spans(start, stop):
+        return np.maximum.reduceat(Vs, start) - np.minimum.reduceat(Vs, start)
+
+    # runs too small to be a real sweep become flat, then runs are rebuilt once
+    start, stop, direction = _direction_runs(d)
+    small = spans(start, stop) < min_span_frac * np.ptp(Vs)
+    d[np.repeat(small, stop - start)] = 0
+    start, stop, direction = _direction_runs(d)
+
+    keep = direction != 0
+    start, stop, direction = start[keep], stop[keep], direction[keep]
+    if start.size == 0:
+        return empty
+    cycle = np.cumsum(direction == direction[0]) - 1
+    return {"start": start, "stop": stop, "direction": direction, "cycle": cycle,
+            "span_V": spans(start, stop)}
+
+def _segment_extrema(values, seg_id, n_segments):
+    # argmin of `values` within each segment, via one sort keyed on (segment, value)
+    order = np.lexsort((values, seg_id))
+    first = np.searchsorted(seg_id[order], np.arange(n_segments))
+    return order[first]
+
+def concentration_from_cv_segments(V_volts, I_uA, calibrator, smooth_k=5, peak="reduction",
+                                   smooth=None, aggregate="mean", min_points=3):
+    """
+    Per-half-sweep peak analysis of a multi-cycle CV.
+    The trace is smoothed once, split with segment_sweep, and the peak is taken
+    in every segment of the matching scan direction (cathodic for 'reduction',
+    anodic for 'oxidation', all for 'abs'; partial half-sweeps spanning under
+    half of the widest one are skipped). The segment peaks are combined with
+    aggregate = 'mean' | 'median' | 'last' (last cycle) and the result calibrated.
+    Returns (conc_out, Ip_uA, Vp_mV, peak_idx, segments); peak_idx is the segment
+    peak closest to the aggregate. segments is segment_sweep's dict plus per-segment
+    peak_idx / Ip_uA / Vp_mV (NaN / -1 for segments of the other direction).
+    Falls back to concentration_from_cv when no segment of the right direction exists.
+    """
+    V = np.asarray(V_volts, dtype=float)
+    I_s = make_smoother(smooth, smooth_k)(I_uA) if len(I_uA) else np.empty(0)
+    segs = segment_sweep(V, min_points=min_points)
+    found = _segment_peaks(V, I_s, segs, peak, aggregate, min_points)
+    if found is None:
+        return concentration_from_cv(V, I_uA, calibrator, smooth_k, peak, smooth) + (segs,)
+    Ip, Vp_mV, peak_idx = found
+    conc_out = calibrator.apply(Ip)
+    return conc_out, Ip, Vp_mV, peak_idx, segs
+
+def _segment_peaks(V, I_s, segs, peak, aggregate, min_points):
+    """Aggregated (Ip_uA, Vp_mV, peak_idx) over matching segments, adding per-segment
+    peaks to segs; None when no segment of the right direction exists."""
+    n_seg = segs["start"].size
+    want = {"reduction": -1, "oxidation": 1}.get(peak)
+    use = (segs["direction"] == want) if want is not None else np.ones(n_seg, dtype=bool)
+    use &= (segs["stop"] - segs["start"]) >= min_points
+    if use.any():
+        use &= segs["span_V"] >= 0.5 * segs["span_V"][use].max()
+    if not use.any():
+        return None
+    # segments are contiguous from start[0] to stop[-1]
+    seg_id = np.repeat(np.arange(n_seg), segs["stop"] - segs["start"])
+    if peak == "reduction":
+        score = I_s
+    elif peak == "oxidation":
+        score = -I_s
+    else:
+        score = -np.abs(I_s)
+    idx = _segment_extrema(score[segs["start"][0]:segs["stop"][-1]], seg_id, n_seg) + segs["start"][0]
+
+    segs["peak_idx"] = np.where(use, idx, -1)
+    segs["Ip_uA"] = np.where(use, I_s[idx], np.nan)
+    segs["Vp_mV"] = np.where(use, V[idx] * 1000.0, np.nan)
+
+    cand = np.flatnonzero(use)
+    if want is None:
+        # 'abs': only average peaks on the same side as the strongest one
+        sign = np.sign(segs["Ip_uA"][cand[np.argmax(np.abs(segs["Ip_uA"][cand]))]])
+        cand = cand[np.sign(segs["Ip_uA"][cand]) == sign]
+    if aggregate == "last":
+        cand = cand[segs["cycle"][cand] == segs["cycle"][cand].max()]
+        Ip = float(np.mean(segs["Ip_uA"][cand]))
+    elif aggregate == "median":
+        Ip = float(np.median(segs["Ip_uA"][cand]))
+    elif aggregate == "mean":
+        Ip = float(np.mean(segs["Ip_uA"][cand]))
+    else:
+        raise ValueError(f"Unknown aggregate: {aggregate}")
+    best = cand[np.argmin(np.abs(segs["Ip_uA"][cand] - Ip))]
+    return Ip, float(segs["Vp_mV"][best]), int(segs["peak_idx"][best])
+
+
+# thresholds for signal_quality flags
+QUALITY_LIMITS = {
+    "min_samples": 50,            # sweep length
+    "min_snr": 5.0,               # peak height / noise floor
+    "max_saturated_frac": 0.0,    # share of samples at the current-range limit
+    "min_points_per_fwhm": 3,     # samples across the peak
+}
+SATURATION_FRAC = 0.98            # |I| above this share of the range counts as clipped
+_RANGE_UNITS_UA = {"na": 1e-3, "ua": 1.0, "ma": 1e3}
+
+def curr_range_limit_uA(curr_range):
+    """'100uA' -> 100.0; None if unknown."""
+    if curr_range is None:
+        return None
+    text = str(curr_range).strip().lower()
+    scale = _RANGE_UNITS_UA.get(text[-2:])
+    try:
+        return float(text[:-2]) * scale if scale else None
+    except ValueError:
+        return None
+
+def signal_quality(V, I_uA, I_s, peak_idx, segs=None, curr_range=None, limits=None):
+    """
+    Quality metrics of one analysed sweep, reusing its smoothed trace I_s.
+    Returns a dict: noise_uA (robust std of I - I_s), snr (baseline-corrected
+    peak height / noise), fwhm_mV, points_per_fwhm, baseline_slope_uA_per_V
+    (line through the ends of the peak's half-sweep), saturated_frac, n_samples,
+    and flags: a list of the limits (QUALITY_LIMITS) the sweep fails.
+    """
+    limits = dict(QUALITY_LIMITS, **(limits or {}))
+    V = np.asarray(V, dtype=float)
+    I = np.asarray(I_uA, dtype=float)
+    n = I.size
+    q = {"n_samples": int(n), "noise_uA": float("nan"), "snr": float("nan"),
+         "fwhm_mV": float("nan"), "points_per_fwhm": 0, "baseline_slope_uA_per_V": float("nan"),
+         "saturated_frac": 0.0, "flags": []}
+    if n == 0 or peak_idx is None:
+        q["flags"].append("no_data")
+        return q
+
+    resid = I - I_s
+    q["noise_uA"] = float(1.4826 * np.median(np.abs(resid - np.median(resid))))
+
+    # the half-sweep holding the peak, or the whole trace
+    a, b = 0, n
+    if segs is not None and segs["start"].size:
+        hit = np.flatnonzero((segs["start"] <= peak_idx) & (peak_idx < segs["stop"]))
+        if hit.size:
+            a, b = int(segs["start"][hit[0]]), int(segs["stop"][hit[0]])
+    Vw, Iw = V[a:b], I_s[a:b]
+    edge = max(2, (b - a) // 10)
+    ends = np.r_[0:min(edge, b - a), max(b - a - edge, 0):b - a]
+    if np.ptp(Vw[ends]) > 0:
+        slope, icpt = np.polyfit(Vw[ends], Iw[ends], 1)
+    else:
+        slope, icpt = 0.0, float(np.mean(Iw[ends]))
+    q["baseline_slope_uA_per_V"] = float(slope)
+    rel = Iw - (slope * Vw + icpt)
+    j = peak_idx - a
+    height = float(rel[j])
+    if q["noise_uA"] > 0:
+        q["snr"] = abs(height) / q["noise_uA"]
+    elif height != 0:
+        q["snr"] = float("inf")
+
+    # full width at half maximum, walking out from the peak
+    below = np.flatnonzero(rel * np.sign(height) < abs(height) / 2.0)
+    left, right = below[below < j], below[below > j]
+    if height != 0 and left.size and right.size:
+        q["fwhm_mV"] = float(abs(Vw[right[0]] - Vw[left[-1]]) * 1000.0)
+        q["points_per_fwhm"] = int(right[0] - left[-1])
+
+    limit = curr_range_limit_uA(curr_range)
+    if limit:
+        q["saturated_frac"] = float(np.mean(np.abs(I) >= SATURATION_FRAC * limit))
+
+    flags = q["flags"]
+    if n < limits["min_samples"]:
+        flags.append("too_few_samples")
+    if not q["snr"] >= limits["min_snr"]:
+        flags.append("low_snr")
+    if q["saturated_frac"] > limits["max_saturated_frac"]:
+        flags.append("saturated")
+    if q["points_per_fwhm"] < limits["min_points_per_fwhm"]:
+        flags.append("peak_unresolved")
+    return q
+
+def analyze_cv(V_volts, I_uA, calibrator, smooth_k=5, peak="reduction", smooth=None,
+               aggregate=None, curr_range=None, limits=None, min_points=3):
+    """
+    One-pass analysis: smoothing, peak (whole trace, or per half-sweep when
+    aggregate is 'mean' | 'median' | 'last'), signal_quality and calibration.
+    Returns a dict with conc, Ip_uA, Vp_mV, peak_idx, segments (or None) and
+    quality; conc is None for an empty sweep or calibrator=None. Calibrator
+    errors propagate.
+    """
+    V = np.asarray(V_volts, dtype=float)
+    I = np.asarray(I_uA, dtype=float)
+    out = {"conc": None, "Ip_uA": None, "Vp_mV": None, "peak_idx": None, "segments": None}
+    if V.size == 0 or I.size == 0:
+        out["quality"] = signal_quality(V, I, I, None, limits=limits)
+        return out
+
+    I_s = make_smoother(smooth, smooth_k)(I)
+    segs = segment_sweep(V, min_points=min_points)
+    found = None
+    if aggregate is not None:
+        found = _segment_peaks(V, I_s, segs, peak, aggregate, min_points)
+        if found is not None:
+            out["segments"] = segs
+    if found is None:
+        found = _peak_of(V, I_s, peak)
+    out["Ip_uA"], out["Vp_mV"], out["peak_idx"] = found
+    out["quality"] = signal_quality(V, I, I_s, out["peak_idx"], segs, curr_range, limits)
+    if calibrator is not None:
+        out["conc"] = calibrator.apply(out["Ip_uA"])
+    return out
@@ -0,0 +1,217 @@
+# smoothing.py
+"""
+smoothing.py - Smoothing filters for CV current traces.
+
+All filters take a 1-D array and return one of the same length, handle the
+sweep ends without zero padding, and smooth sweeps of any length (a filter
+never silently passes data through because it is short).
+
+    boxcar       centred moving average via one cumulative sum, O(n) for any
+                 window; windows shrink at the ends
+    savgol       Savitzky-Golay (polynomial least squares) from running
+                 moment sums, O(n) for any window; ends use the polynomial
+                 fitted to the first / last window. Short sweeps shrink the
+                 window and, if needed, the order (always below window - 1)
+    median       running median, in chunks of bounded memory; windows shrink
+                 at the ends
+    exponential  zero-phase (forward + backward) exponential filter, seeded
+                 with the end values; O(n) for any span
+
+A smoothing spec, as accepted by sensor_pipeline.concentration_from_cv(smooth=...):
+    None / int k           boxcar of width k
+    "median" / "savgol:7"  filter name, optional window after a colon
+    ("savgol", 7)          (name, window)
+    {"kind": "savgol", "window": 9, "order": 3}
+    callable               used as is: f(x) -> smoothed x
+"""
+from math import comb
+import numpy as np
+from numpy.lib.stride_tricks import as_strided, sliding_window_view
+
+DEFAULT_WINDOW = 5
+# savgol moment sums are taken within blocks short enough that differencing
+# them loses at most ~SAVGOL_MAX_CANCEL * eps (relative)
+SAVGOL_MAX_CANCEL = 1e4
+MEDIAN_CHUNK = 1 << 20          # window elements sorted per np.median call (8 MB)
+
+def boxcar(x, window=DEFAULT_WINDOW):
+    x = np.asarray(x, dtype=float)
+    n, k = x.size, int(window)
+    if k <= 1 or n == 0:
+        return x.copy()
+    left, right = k // 2, (k - 1) // 2      # same centring as np.convolve(mode="same")
+    c = np.empty(n + 1)
+    c[0] = 0.0
+    np.cumsum(x, out=c[1:])
+    out = np.empty(n)
+    # interior: full windows, plain slices
+    if n >= k:
+        out[left:n - right] = c[k:] - c[:n - k + 1]
+        out[left:n - right] /= k
+    # ends (or everything, for sweeps shorter than the window): shrinking windows
+    ends = np.r_[0:min(left, n), max(n - right, left, min(left, n)):n] if n >= k else np.arange(n)
+    lo = np.maximum(ends - left, 0)
+    hi = np.minimum(ends + right, n - 1) + 1
+    out[ends] = (c[hi] - c[lo]) / (hi - lo)
+    return out
+
+def _savgol_coeffs(window, order):
+    # row r of the pseudo-inverse gives the fitted polynomial's value at offset r
+    offsets = np.arange(window) - window // 2
+    A = np.vander(offsets, order + 1, increasing=True)
+    return A, np.linalg.pinv(A)
+
+def _savgol_interior(x, w, order):
+    """Centre-point fits of every full window, from running moment sums.
+
+    The centre weight of offset r is a polynomial h(r) = sum_m a_m r**m, so each
+    output is sum_p g_p(c) * S_p, with S_p = sum of u**p * x over the window
+    (a difference of two cumulative sums) and c the window centre in u.
+    """
+    n = x.size
+    A = np.vander(np.arange(w) - w // 2, order + 1, increasing=True)
+    a = np.linalg.inv(A.T @ A)[0]
+    m = n - w + 1                               # number of full windows
+    ratio = SAVGOL_MAX_CANCEL ** (1.0 / (order + 1))
+    B = int(min(m, max(1, w * (ratio - 1))))    # outputs per block
+    nb = -(-m // B)
+    L = B + w - 1
+    xp = np.zeros(nb * B + w - 1)
+    xp[:n] = x
+    rows = as_strided(xp, shape=(nb, L), strides=(B * xp.strides[0], xp.strides[0]), writeable=False)
+    mid = (L - 1) / 2.0                         # local origin: keeps |u| <= L / 2
+    u = np.arange(L) - mid
+    c = np.arange(B) + w // 2 - mid             # window centres
+    out = np.zeros((nb, B))
+    up = np.ones(L)
+    cs = np.empty((nb, L + 1))
+    cs[:, 0] = 0.0
+    for p in range(order + 1):
+        np.cumsum(rows * up, axis=1, out=cs[:, 1:])
+        g = sum(a[k] * comb(k, p) * (-c) ** (k - p) for k in range(p, order + 1))
+        out += (cs[:, w:w + B] - cs[:, :B]) * g
+        up = up * u
+    return out.ravel()[:m]
+
+def savgol(x, window=DEFAULT_WINDOW, order=2):
+    x = np.asarray(x, dtype=float)
+    n = x.size
+    if int(window) <= 1 or int(order) < 0 or n <= 1:
+        return x.copy()
+    w = int(window) | 1                     # odd window
+    w = min(w, n if n % 2 else n - 1)
+    if w < 3:                               # two samples: the order-0 fit, as boxcar gives
+        return np.full(n, x.mean())
+    # a degree w-1 polynomial goes through every point and would smooth nothing
+    order = min(int(order), w - 2)
+    A, pinv = _savgol_coeffs(w, order)
+    out = np.empty_like(x)
+    half = w // 2
+    out[half:n - half] = _savgol_interior(x, w, order)
+    # ends: evaluate the polynomial fitted to the first / last full window
+    out[:half] = (A @ (pinv @ x[:w]))[:half]
+    out[n - half:] = (A @ (pinv @ x[n - w:]))[w - half:]
+    return out
+
+def median(x, window=DEFAULT_WINDOW):
+    x = np.asarray(x, dtype=float)
+    n, k = x.size, int(window)
+    if k <= 1 or n == 0:
+        return x.copy()
+    left, right = k // 2, (k - 1) // 2
+    padded = np.concatenate([np.full(left, np.nan), x, np.full(right, np.nan)])
+    windows = sliding_window_view(padded, k)
+    out = np.empty(n)
+    inner = slice(left, max(n - right, left))
+    # np.median copies what it sorts, so feed it a bounded number of windows at a time
+    step = max(1, MEDIAN_CHUNK // k)
+    for s in range(inner.start, inner.stop, step):
+        e = min(s + step, inner.stop)
+        out[s:e] = np.median(windows[s:e], axis=1)
+    # shrinking windows at the ends: only these few rows contain padding
+    for i in list(range(min(left, n))) + list(range(max(n - right, left), n)):
+        out[i] = np.nanmedian(windows[i])
+    return out
+
+# per-block rescaling bound: error stays relative to the newest term, so this
+# only has to keep beta**-B well inside the float range
+_EXP_BLOCK_SCALE = 1e100
+
+def _exp_forward(x, alpha, y0):
+    """y[i] = alpha*x[i] + (1-alpha)*y[i-1], y[-1] = y0, without a per-sample Python loop."""
+    beta = 1.0 - alpha
+    n = x.size
+    if beta <= 0.0:
+        return x.copy()
+    # closed form within blocks short enough that beta**-B stays bounded
+    B = max(1, int(np.log(_EXP_BLOCK_SCALE) / -np.log(beta)))
+    powers = beta ** np.arange(min(B, n))
+    inv_powers = 1.0 / powers
+    out = np.empty(n)
+    prev = y0
+    for s in range(0, n, B):
+        blk = x[s:s + B]
+        m = blk.size
+        acc = np.cumsum(blk * inv_powers[:m]) * powers[:m]
+        out[s:s + m] = alpha * acc + prev * beta * powers[:m]
+        prev = out[s + m - 1]
+    return out
+
+def exponential(x, window=DEFAULT_WINDOW, alpha=None):
+    """Zero-phase EMA; window is the span (alpha = 2 / (window + 1)) unless alpha is given."""
+    x = np.asarray(x, dtype=float)
+    if x.size == 0:
+        return x.copy()
+    if alpha is None:
+        if int(window) <= 1:
+            return x.copy()
+        alpha = 2.0 / (float(window) + 1.0)
+    fwd = _exp_forward(x, float(alpha), x[0])
+    return _exp_forward(fwd[::-1], float(alpha), fwd[-1])[::-1]
+
+FILTERS = {
+    "boxcar": boxcar,
+    "savgol": savgol,
+    "median": median,
+    "exponential": exponential,
+}
+_ALIASES = {"movavg": "boxcar", "mean": "boxcar", "sg": "savgol", "ema": "exponential", "exp": "exponential"}
+
+def register_filter(name, fn):
+    """Add a filter f(x, window=..., **options) usable in smoothing specs."""
+    FILTERS[name.lower()] = fn
+
+def parse_spec(spec, default_window=DEFAULT_WINDOW):
+    """Normalise a smoothing spec to (kind, options); callables come back as (fn, {})."""
+    if callable(spec):
+        return spec, {}
+    if spec is None:
+        return "boxcar", {"window": int(default_window)}
+    if isinstance(spec, (int, np.integer)):
+        return "boxcar", {"window": int(spec)}
+    if isinstance(spec, str):
+        name, _, window = spec.partition(":")
+        options = {"window": int(window) if window else int(default_window)}
+    elif isinstance(spec, (tuple, list)):
+        name = spec[0]
+        options = {"window": int(spec[1]) if len(spec) > 1 else int(default_window)}
+        if len(spec) > 2:
+            options.update(spec[2])
+    elif isinstance(spec, dict):
+        options = dict(spec)
+        name = options.pop("kind", "boxcar")
+        options.setdefault("window", int(default_window))
+    else:
+        raise ValueError(f"Unsupported smoothing spec: {spec!r}")
+    kind = _ALIASES.get(name.lower(), name.lower())
+    if kind not in FILTERS:
+        raise ValueError(f"Unknown smoothing filter: {name}")
+    return kind, options
+
+def make_smoother(spec, default_window=DEFAULT_WINDOW):
+    """Build f(x) -> smoothed x from a smoothing spec."""
+    kind, options = parse_spec(spec, default_window)
+    if callable(kind):
+        return lambda x: np.asarray(kind(np.asarray(x, dtype=float)), dtype=float)
+    fn = FILTERS[kind]
+    return lambda x: fn(x, **options)
@@ -0,0 +1,207 @@
+# snapshot_writer.py
+"""
+snapshot_writer.py - Graph snapshots written off the UI thread.
+
+The UI thread only takes a copy of what is to be saved; PNG encoding and the
+disk write happen on one background writer thread. Pending snapshots are
+bounded: a second snapshot for a path that is still queued replaces the first
+(coalesce), and when MAX_PENDING are waiting the oldest is dropped.
+
+    texture   copy the graph's rendered pixels (what is on screen, axes and all)
+    series    copy the raw (x, y) arrays; the writer rasterises them itself
+    archive   write nothing: the raw sweep is already in cv_archive and is
+              rendered on demand (plot_run / snapshot_run by run_id)
+
+PNGs are encoded with zlib only, so no imaging library is needed.
+"""
+import os, struct, threading, zlib
+from collections import OrderedDict
+import numpy as np
+from decimation import decimate
+
+SNAPSHOT_MODE = "texture"        # "texture" | "series" | "archive"
+MAX_PENDING = 4
+SNAPSHOT_SIZE = (800, 600)       # (width, height) of series renders
+MARGIN_PX = 20
+LINE_COLOR = (255, 0, 0, 255)
+FRAME_COLOR = (0, 0, 0, 255)
+AXIS_COLOR = (170, 170, 170, 255)
+
+# --- PNG / rasterising (run on the writer thread) ---
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+def encode_png(rgba, level=6) -> bytes:
+    """PNG bytes for an (h, w, 4) uint8 RGBA array, first row at the top."""
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    h, w = rgba.shape[:2]
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)      # filter byte 0 per row
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level))
+            + _png_chunk(b"IEND", b""))
+
+def render_series(x, y, size=SNAPSHOT_SIZE, color=LINE_COLOR):
+    """Rasterise a polyline to an (h, w, 4) RGBA array (white background, framed)."""
+    w, h = int(size[0]), int(size[1])
+    img = np.full((h, w, 4), 255, dtype=np.uint8)
+    m = MARGIN_PX
+    img[[m, h - 1 - m], m:w - m] = FRAME_COLOR
+    img[m:h - m, [m, w - 1 - m]] = FRAME_COLOR
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    if x.size == 0:
+        return img
+    idx = decimate(x, y, 4 * w)                          # a few vertices per pixel is plenty
+    x, y = x[idx], y[idx]
+    x0, xs = x.min(), (np.ptp(x) or 1.0)
+    y0, ys = y.min(), (np.ptp(y) or 1.0)
+    px = m + 1 + (x - x0) / xs * (w - 3 - 2 * m)
+    py = h - 2 - m - (y - y0) / ys * (h - 3 - 2 * m)
+    if y0 < 0 < y0 + ys:                                 # zero line
+        img[int(round(h - 2 - m - (0 - y0) / ys * (h - 3 - 2 * m))), m + 1:w - m - 1] = AXIS_COLOR
+    if px.size == 1:
+        img[int(round(py[0])), int(round(px[0]))] = color
+        return img
+    # every segment sampled once per pixel of its longer side
+    dx, dy = np.diff(px), np.diff(py)
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.intp) + 1
+    seg = np.repeat(np.arange(steps.size), steps)
+    frac = (np.arange(seg.size) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    cols = np.rint(px[seg] + frac * dx[seg]).astype(np.intp)
+    rows = np.rint(py[seg] + frac * dy[seg]).astype(np.intp)
+    img[rows, cols] = color
+    img[np.minimum(rows + 1, h - 1), cols] = color       # 2 px wide
+    return img
+
+def _write_atomic(path, data):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+# --- writer ---
+class SnapshotWriter:
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = int(max_pending)
+        self.dropped = 0                 # snapshots discarded because the queue was full
+        self.written = 0
+        self._pending = OrderedDict()    # path -> job, oldest first
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+
+    def submit_pixels(self, path, pixels, size, flip=True):
+        """Queue raw RGBA bytes (e.g. texture.pixels, bottom row first when flip) for encoding."""
+        self._put(path, ("pixels", bytes(pixels), (int(size[0]), int(size[1])), flip))
+
+    def submit_series(self, path, x, y, size=SNAPSHOT_SIZE):
+        """Queue a copy of (x, y) to be rendered and written."""
+        self._put(path, ("series", np.array(x, dtype=float), np.array(y, dtype=float), size))
+
+    def _put(self, path, job):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Snapshot writer is closed")
+            if path in self._pending:
+                self._pending[path] = job             # coalesce: newest content wins
+            else:
+                if len(self._pending) >= self.max_pending:
+                    self._pending.popitem(last=False)
+                    self.dropped += 1
+                self._pending[path] = job
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                path, job = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                _write_atomic(path, encode_png(self._render(job)))
+                self.written += 1
+            except Exception as e:
+                print("Could not write snapshot:", path, e)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _render(job):
+        if job[0] == "pixels":
+            _, pixels, (w, h), flip = job
+            rgba = np.frombuffer(pixels, dtype=np.uint8).reshape(h, w, 4)
+            return rgba[::-1] if flip else rgba
+        _, x, y, size = job
+        return render_series(x, y, size)
+
+    def flush(self, timeout=None) -> bool:
+        """Wait until everything queued is written; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def close(self, timeout=5.0):
+        """Write what is pending, then stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+
+_writer = None
+
+def get_snapshot_writer() -> SnapshotWriter:
+    global _writer
+    if _writer is None:
+        _writer = SnapshotWriter()
+    return _writer
+
+def close_snapshot_writer():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+# --- UI-facing helpers ---
+def save_snapshot(path, widget=None, series=None, mode=None):
+    """
+    Queue a snapshot of a graph. Call on the UI thread: in "texture" mode the
+    widget is rendered to a texture and its pixels copied; in "series" mode
+    series=(x, y) is copied. Nothing is saved in "archive" mode.
+    """
+    mode = SNAPSHOT_MODE if mode is None else mode
+    if mode == "archive":
+        return
+    if mode == "texture" and widget is not None:
+        texture = widget.export_as_image().texture
+        get_snapshot_writer().submit_pixels(path, texture.pixels, texture.size)
+    elif mode in ("texture", "series") and series is not None:
+        get_snapshot_writer().submit_series(path, series[0], series[1])
+    else:
+        raise ValueError(f"Unknown snapshot mode or nothing to save: {mode}")
+
+def plot_run(graph, run_id, keep=()):
+    """Show an archived sweep (V vs I) on a CreatinineGraph, on demand."""
+    from cv_archive import get_archive
+    _, V, I_uA = get_archive().read(run_id)
+    graph.update_graph(V, I_uA, keep=keep)
+    return V, I_uA
+
+def snapshot_run(run_id, path, size=SNAPSHOT_SIZE):
+    """Render an archived sweep to a PNG in the background."""
+    from cv_archive import get_archive
+    _, V, I_uA = get_archive().read(run_id)
+    get_snapshot_writer().submit_series(path, V, I_uA, size)
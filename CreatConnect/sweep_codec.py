@@ -0,0 +1,199 @@
+# sweep_codec.py
+"""
+sweep_codec.py - Compact, error-bounded encoding of one CV sweep.
+
+A sweep's t and V are ramps, so they are stored as linear segments
+(start index, start value, step per sample) whenever that reproduces every
+sample within the channel's max error. Anything else - always the noisy
+current - is quantised to a grid of 2 * max_error, delta encoded (first or
+second differences, whichever compresses better), narrowed to the smallest
+integer type and zlib-compressed. NaN / inf samples are cut out and stored
+separately (positions plus their exact values); the finite samples around
+them are encoded as above.
+
+Every finite sample decodes to within max_error of the input, and every
+non-finite one to the same NaN / inf:
+
+    t      TIME_MAX_ERROR_S      1 µs
+    V      VOLTAGE_MAX_ERROR_V   10 µV
+    I      CURRENT_MAX_ERROR_UA  0.5 nA
+
+A blob is self-contained (header + payload), so cv_archive can store blobs
+back to back and decode any one run by offset. A 1000-point sweep takes
+~1-2 kB instead of 12 kB as float32 columns or ~40 kB as decimal CSV.
+
+Usage (from CreatConnect/):
+    python sweep_codec.py simulated_data/*.csv      # size and max error per file
+"""
+import json, struct, sys, zlib
+import numpy as np
+
+MAGIC = b"SWC1"
+TIME_MAX_ERROR_S = 1e-6
+VOLTAGE_MAX_ERROR_V = 1e-5
+CURRENT_MAX_ERROR_UA = 5e-4
+ZLIB_LEVEL = 6
+MAX_SEGMENT_FRAC = 0.125       # more segments than this per sample: not a ramp
+CHANNELS = ("t", "V", "I_uA")
+
+def _linear_segments(x, max_error):
+    """(starts, values, steps) reproducing x within max_error, or None."""
+    n = x.size
+    if n < 2:
+        return np.zeros(n), x.astype(float), np.zeros(n)
+    d = np.diff(x)
+    # a new segment wherever the step changes
+    starts = np.r_[0, 1 + np.flatnonzero(np.abs(np.diff(d)) > max_error)]
+    if starts.size > max(2, MAX_SEGMENT_FRAC * n):
+        return None
+    ends = np.r_[starts[1:], n - 1]             # segment k covers starts[k]..ends[k]
+    values = x[starts].astype(float)
+    steps = (x[ends].astype(float) - values) / np.maximum(ends - starts, 1)
+    if np.max(np.abs(_ramp(n, starts, values, steps) - x)) > max_error:
+        return None
+    return starts.astype(float), values, steps
+
+def _ramp(n, starts, values, steps):
+    seg = np.searchsorted(starts, np.arange(n), side="right") - 1
+    return values[seg] + (np.arange(n) - starts[seg]) * steps[seg]
+
+def _diff_encode(k, order):
+    heads, d = [], k
+    for _ in range(order):
+        heads.append(int(d[0]))
+        d = np.diff(d)
+    return heads, d
+
+def _diff_decode(heads, d):
+    for h in reversed(heads):
+        d = np.concatenate([[h], h + np.cumsum(d)])
+    return d
+
+def _narrow(d):
+    for dtype in ("<i1", "<i2", "<i4"):
+        info = np.iinfo(dtype)
+        if d.size == 0 or (d.min() >= info.min and d.max() <= info.max):
+            return d.astype(dtype)
+    return d.astype("<i8")
+
+def _encode_masked(x, max_error):
+    bad = np.flatnonzero(~np.isfinite(x))
+    desc, payload = _encode_channel(x[np.isfinite(x)], max_error)
+    # positions delta encoded; NaN / +-inf are exact in float32
+    pos = _narrow(np.diff(bad, prepend=0))
+    extra = zlib.compress(pos.tobytes() + x[bad].astype("<f4").tobytes(), ZLIB_LEVEL)
+    return ({"kind": "masked", "inner": desc, "inner_bytes": len(payload), "n_bad": int(bad.size),
+             "pos_dtype": pos.dtype.str}, payload + extra)
+
+def _decode_masked(desc, payload, n):
+    m = desc["n_bad"]
+    inner = _decode_channel(desc["inner"], payload[:desc["inner_bytes"]], n - m)
+    extra = zlib.decompress(payload[desc["inner_bytes"]:])
+    pos_size = np.dtype(desc["pos_dtype"]).itemsize * m
+    bad = np.cumsum(np.frombuffer(extra[:pos_size], dtype=desc["pos_dtype"]).astype(np.int64))
+    x = np.empty(n)
+    keep = np.ones(n, dtype=bool)
+    keep[bad] = False
+    x[keep] = inner
+    x[bad] = np.frombuffer(extra[pos_size:], dtype="<f4")
+    return x
+
+def _encode_channel(x, max_error):
+    x = np.asarray(x, dtype=float).ravel()
+    if x.size and not np.all(np.isfinite(x)):
+        return _encode_masked(x, max_error)
+    seg = _linear_segments(x, max_error)
+    if seg is not None:
+        return {"kind": "linear"}, np.column_stack(seg).astype("<f8").tobytes()
+    q = 2.0 * max_error
+    k = np.rint(x / q).astype(np.int64)
+    best = None
+    for order in (1, 2):
+        if k.size <= order:
+            break
+        heads, d = _diff_encode(k, order)
+        d = _narrow(d)
+        payload = zlib.compress(d.tobytes(), ZLIB_LEVEL)
+        if best is None or len(payload) < len(best[1]):
+            best = ({"kind": "delta", "q": q, "heads": heads, "dtype": d.dtype.str}, payload)
+    if best is None:                            # 0 or 1 samples
+        best = ({"kind": "delta", "q": q, "heads": k.tolist(), "dtype": "<i1"}, b"")
+    return best
+
+def _decode_channel(desc, payload, n):
+    kind = desc["kind"]
+    if kind == "masked":
+        return _decode_masked(desc, payload, n)
+    if kind == "raw":                           # older blobs: float32 fallback for non-finite channels
+        return np.frombuffer(zlib.decompress(payload), dtype="<f4").astype(float)
+    if kind == "linear":
+        starts, values, steps = np.frombuffer(payload, dtype="<f8").reshape(-1, 3).T
+        return _ramp(n, starts, values, steps)
+    if kind == "delta":
+        heads = desc["heads"]
+        if n <= len(heads):
+            k = np.asarray(heads[:n], dtype=np.int64)
+        else:
+            d = np.frombuffer(zlib.decompress(payload), dtype=desc["dtype"]).astype(np.int64)
+            k = _diff_decode(heads, d)
+        return k * desc["q"]
+    raise ValueError(f"Unknown sweep channel encoding: {kind}")
+
+def encode_sweep(t, V, I_uA, max_errors=(TIME_MAX_ERROR_S, VOLTAGE_MAX_ERROR_V, CURRENT_MAX_ERROR_UA)) -> bytes:
+    """Encode one sweep; every channel is reproduced within its max error."""
+    cols = [np.asarray(c, dtype=float).ravel() for c in (t, V, I_uA)]
+    n = cols[0].size
+    if any(c.size != n for c in cols):
+        raise ValueError("t, V and I must have the same length")
+    header = {"n": n, "channels": []}
+    payloads = []
+    for name, x, err in zip(CHANNELS, cols, max_errors):
+        desc, payload = _encode_channel(x, float(err))
+        desc.update(name=name, max_error=float(err), bytes=len(payload))
+        header["channels"].append(desc)
+        payloads.append(payload)
+    head = json.dumps(header, separators=(",", ":")).encode()
+    return MAGIC + struct.pack("<I", len(head)) + head + b"".join(payloads)
+
+def decode_sweep(blob):
+    """(t, V, I_uA) float64 arrays from an encode_sweep blob (trailing padding is ignored)."""
+    blob = bytes(blob)
+    if blob[:4] != MAGIC:
+        raise ValueError("Not an encoded sweep")
+    size = struct.unpack("<I", blob[4:8])[0]
+    header = json.loads(blob[8:8 + size])
+    pos = 8 + size
+    out = []
+    for desc in header["channels"]:
+        payload = blob[pos:pos + desc["bytes"]]
+        pos += desc["bytes"]
+        out.append(_decode_channel(desc, payload, header["n"]))
+    return tuple(out)
+
+def save(path, t, V, I_uA):
+    with open(path, "wb") as f:
+        f.write(encode_sweep(t, V, I_uA))
+
+def load(path):
+    with open(path, "rb") as f:
+        return decode_sweep(f.read())
+
+def main(argv=None):
+    import os
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        print(__doc__)
+        return 2
+    for path in paths:
+        data = np.loadtxt(path, delimiter=",", skiprows=1, encoding="utf-8", ndmin=2)
+        V, I = data[:, 0], data[:, 1]
+        t = np.arange(V.size, dtype=float)          # the CSVs carry no time column
+        blob = encode_sweep(t, V, I)
+        _, V2, I2 = decode_sweep(blob)
+        print(f"{os.path.basename(path):<40} {os.path.getsize(path):>8} B csv  "
+              f"{3 * 4 * V.size:>7} B f32  {len(blob):>6} B encoded  "
+              f"max err V={np.max(np.abs(V2 - V)):.1e} I={np.max(np.abs(I2 - I)):.1e}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+# test_data_exchange.py
+"""Export / import round trips through data_exchange (run: python -m pytest -q)."""
+import json
+import numpy as np
+import pytest
+import data_exchange
+from sweep_codec import CURRENT_MAX_ERROR_UA
+from cv_archive import CvArchive
+from data_storage import ReadingsStore
+
+def _records():
+    t = np.arange(50, dtype=float) * 0.01
+    V = np.linspace(-0.4, 0.4, 50)
+    I_uA = np.sin(V * 10)
+    I_uA[7] = np.nan                                  # e.g. a dropped / clipped sample
+    return [
+        {"uid": "a" * 32, "ts": 1.7e9, "conc_mg_dL": 1.2, "Ip_uA": float("nan"), "Vp_mV": -150.0,
+         "status": "Normal", "calibration_id": None, "device_id": 1, "source": "simulated_pstat",
+         "sweep": (t, V, I_uA)},
+        {"uid": "b" * 32, "ts": 1.7e9 + 60, "conc_mg_dL": 0.9, "Ip_uA": -4.0, "Vp_mV": None,
+         "status": "Low", "calibration_id": None, "device_id": None, "source": None, "sweep": None},
+    ]
+
+@pytest.mark.parametrize("ext", [".jsonl", ".csv", ".ccol"])
+def test_round_trip_with_nan_sample(tmp_path, ext):
+    path = str(tmp_path / f"export{ext}")
+    assert data_exchange.export(path, records=_records()) == 2
+    if ext == ".jsonl":
+        with open(path) as f:
+            for line in f:
+                json.loads(line, parse_constant=pytest.fail)     # strict JSON: no NaN / Infinity
+    store = ReadingsStore(str(tmp_path / "readings.db"))
+    archive = CvArchive(str(tmp_path / "archive"))
+    try:
+        assert data_exchange.import_file(path, store=store, archive=archive) == (2, 2, 0)
+        assert data_exchange.import_file(path, store=store, archive=archive) == (2, 0, 0)
+        rows = list(store.iter_rows())
+        assert [r["uid"] for r in rows] == ["a" * 32, "b" * 32]
+        assert rows[0]["Ip_uA"] is None and rows[1]["Ip_uA"] == -4.0
+        t, V, I_uA = _records()[0]["sweep"]
+        t2, V2, I2 = archive.read(rows[0]["run_id"])
+        assert np.allclose(t2, t) and np.allclose(V2, V)
+        assert np.array_equal(np.isnan(I2), np.isnan(I_uA))
+        assert np.allclose(I2, I_uA, equal_nan=True, rtol=0, atol=CURRENT_MAX_ERROR_UA)   # archive may compress
+    finally:
+        store.close()
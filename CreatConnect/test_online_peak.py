@@ -0,0 +1,31 @@
+# test_online_peak.py
+"""OnlinePeakDetector against batch concentration_from_cv (run: python -m pytest -q)."""
+import os
+import numpy as np
+import pytest
+import pstat_sim
+from calibration import Calibrator
+from sensor_pipeline import OnlinePeakDetector, concentration_from_cv
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARAMS = {"quietValue": 0.0, "quietTime": 1000, "amplitude": 0.4, "offset": 0.0,
+          "period": 1000, "numCycles": 2, "shift": 0.0}
+
+@pytest.fixture(scope="module")
+def calibrator():
+    return Calibrator(os.path.join(HERE, "calibration.json"))
+
+@pytest.mark.parametrize("smooth_k", [1, 4, 5, 11])
+@pytest.mark.parametrize("peak", ["reduction", "oxidation", "abs"])
+@pytest.mark.parametrize("chunk", [1, 7, 64, 10_000])
+def test_online_matches_batch(calibrator, smooth_k, peak, chunk):
+    _, V, I_uA = pstat_sim.cv_curve(PARAMS, concentration_mg_dL=1.0, rng=np.random.default_rng(0))
+    det = OnlinePeakDetector(calibrator, smooth_k=smooth_k, peak=peak)
+    for s in range(0, V.size, chunk):
+        det.feed(V[s:s + chunk], I_uA[s:s + chunk])
+    conc, Ip_uA, Vp_mV, peak_idx = det.finish().result()
+    b_conc, b_Ip_uA, b_Vp_mV, b_idx = concentration_from_cv(V, I_uA, calibrator, smooth_k=smooth_k, peak=peak)
+    assert peak_idx == b_idx
+    assert Ip_uA == pytest.approx(b_Ip_uA, rel=1e-9, abs=1e-12)
+    assert Vp_mV == pytest.approx(b_Vp_mV)
+    assert conc == pytest.approx(b_conc, rel=1e-9)
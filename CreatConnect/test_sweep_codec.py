@@ -0,0 +1,37 @@
+# test_sweep_codec.py
+"""Round trip of a simulated sweep through sweep_codec (run: python -m pytest -q)."""
+import numpy as np
+import pstat_sim
+import sweep_codec
+
+PARAMS = {"quietValue": 0.0, "quietTime": 1000, "amplitude": 0.4, "offset": 0.0,
+          "period": 1000, "numCycles": 2, "shift": 0.0}
+
+def _sweep(seed=0):
+    t_ms, V, I_uA = pstat_sim.cv_curve(PARAMS, concentration_mg_dL=1.0, rng=np.random.default_rng(seed))
+    return t_ms / 1000.0, V, I_uA
+
+def test_round_trip_within_max_error():
+    t, V, I_uA = _sweep()
+    blob = sweep_codec.encode_sweep(t, V, I_uA)
+    t2, V2, I2 = sweep_codec.decode_sweep(blob)
+    assert t2.shape == V2.shape == I2.shape == t.shape
+    assert np.max(np.abs(t2 - t)) <= sweep_codec.TIME_MAX_ERROR_S
+    assert np.max(np.abs(V2 - V)) <= sweep_codec.VOLTAGE_MAX_ERROR_V
+    assert np.max(np.abs(I2 - I_uA)) <= sweep_codec.CURRENT_MAX_ERROR_UA
+    assert len(blob) < 3 * 4 * t.size          # smaller than float32 columns
+
+def test_round_trip_short_and_non_finite():
+    for n in (0, 1, 2):
+        x = np.arange(n, dtype=float)
+        for col in sweep_codec.decode_sweep(sweep_codec.encode_sweep(x, x, x)):
+            assert np.allclose(col, x, atol=1e-5)
+    t, V, I_uA = _sweep(1)
+    t = t + 1.7e9                                 # unix-time seconds: float32 would be off by ~100 s
+    t[3] = np.nan
+    I_uA[10], I_uA[11], I_uA[-1] = np.nan, np.inf, -np.inf
+    t2, _, I2 = sweep_codec.decode_sweep(sweep_codec.encode_sweep(t, V, I_uA))
+    for x, x2, err in ((t, t2, sweep_codec.TIME_MAX_ERROR_S), (I_uA, I2, sweep_codec.CURRENT_MAX_ERROR_UA)):
+        ok = np.isfinite(x)
+        assert np.array_equal(x2[~ok], x[~ok], equal_nan=True)
+        assert np.max(np.abs(x2[ok] - x[ok])) <= err
@@ -0,0 +1,41 @@
+# ui_dispatch.py
+"""
+ui_dispatch.py - Single hand-off point from worker threads to the Kivy thread.
+
+Worker threads call post(fn, *args); everything posted is run in order on the
+Kivy main thread, batched into at most one Clock callback per frame instead of
+one Clock.schedule_once lambda per event.
+"""
+import threading
+from collections import deque
+from kivy.clock import Clock
+
+class KivyDispatcher:
+    def __init__(self):
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._trigger = Clock.create_trigger(self._drain, 0)
+
+    def post(self, fn, *args):
+        """Thread-safe: queue fn(*args) for the next frame."""
+        with self._lock:
+            self._pending.append((fn, args))
+        self._trigger()
+
+    def _drain(self, dt):
+        with self._lock:
+            batch, self._pending = self._pending, deque()
+        for fn, args in batch:
+            try:
+                fn(*args)
+            except Exception as e:
+                print("UI dispatch error:", e)
+
+
+_dispatcher = None
+
+def get_dispatcher() -> KivyDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = KivyDispatcher()
+    return _dispatcher
@@ -19,12 +19,14 @@ from kivy.uix.widget import Widget
 import sensor_input # Ensure this file exists and has read_sensor_data()
 from graph import CreatinineGraph
 
-import threading, numpy as np
+import numpy as np
 from kivy.clock import Clock
-from pstat_driver import run_cv_blocking
-from calibration import Calibrator
-from sensor_pipeline import concentration_from_cv
+from measurement_scheduler import MeasurementJob, JobRejected, get_scheduler
+from calibration import get_calibration
+from sensor_pipeline import to_microamps, OnlinePeakDetector
 from personalization import get_status, get_breakdown
+from data_storage import get_store
+from snapshot_writer import save_snapshot
 import sensor_input  # for load_health_info()
 
 Window.clearcolor = (1, 1, 1, 1) # Set window clear color to white
@@ -131,32 +133,88 @@ class CreatConnectUI(BoxLayout):
         self.sim_timer = None
 
     # === RUN POTENTIOSTAT (CV) ===
-    def start_pstat_cv(self, port, params, curr_range="100uA", sample_period_ms=10):
-        """Called by MenuScreen.start_read_sensor"""
+    def start_pstat_cv(self, device_ids, params, curr_range="100uA", sample_period_ms=10,
+                       source="potentiostat"):
+        """Called by MenuScreen.start_read_sensor. Runs one CV per device concurrently;
+        the first device is plotted live. Returns how many runs were started.
+        source is stored with the readings ("simulated_pstat" for pstat_sim runs)."""
+        if isinstance(device_ids, int):
+            device_ids = [device_ids]
+        scheduler = get_scheduler()     # delivers results on the Kivy thread
+        device_ids = [d for d in device_ids if not scheduler.busy(d)]
+        if not device_ids:
+            self.status_label.text = "[b][color=000000]Status:[/color][/b] [b]Measurement already running[/b]"
+            return 0
+
         # Visual reset
         self.graph.clear()
         self.status_label.text = "[b][color=000000]Status:[/color][/b] [b]Running CV...[/b]"
         self.creatinine_label.text = "[b][color=000000]Creatinine: -- mg/dL [/color][/b]"
 
-        self._cal = Calibrator("calibration.json")
+        self._cal = get_calibration("calibration.json")
+        self._live_range = None
+        self._live_peak = OnlinePeakDetector(self._cal, smooth_k=5, peak="reduction")
+        self._multi_device = len(device_ids) > 1
+        self._preset_voltage_axis(params)
 
-        def worker():
+        # acquisition + analysis run on the scheduler's threads; results come back here
+        started = 0
+        for device_id in device_ids:
             try:
-                t, V, I = run_cv_blocking(
-                    port=port,
-                    params=params,
+                scheduler.submit(MeasurementJob(
+                    device_id, params,
                     curr_range=curr_range,
                     sample_period_ms=sample_period_ms,
+                    calibrator=self._cal,
                     name="cyclic",
-                    show_progress=True
-                )
-            except Exception as e:
-                Clock.schedule_once(lambda dt: self._on_pstat_error(str(e)), 0)
-                return
+                    smooth_k=5,
+                    peak="reduction",
+                    aggregate="mean",     # average the cathodic peaks of every cycle
+                    reject_flags=("saturated", "too_few_samples"),
+                    on_chunk=self._on_job_chunk if device_id == device_ids[0] else None,
+                    on_done=lambda job, result: self._on_pstat_done(result, source),
+                    on_error=lambda job, msg: self._on_pstat_error(msg),
+                ))
+                started += 1
+            except JobRejected as e:
+                print(e)
+        return started
+
+    def cancel_pstat_cv(self):
+        """Cancel every running / queued CV measurement."""
+        get_scheduler().cancel()
+
+    def _on_job_chunk(self, job, t_c, V_c, I_c):
+        self._on_pstat_chunk(V_c, I_c)
+
+    def _preset_voltage_axis(self, params):
+        # the sweep limits are known up front, so fix the V axis before data arrives
+        try:
+            lo = float(params["offset"]) - float(params["amplitude"])
+            hi = float(params["offset"]) + float(params["amplitude"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if hi > lo:
+            self.graph.graph.xmin, self.graph.graph.xmax = lo, hi
 
-            Clock.schedule_once(lambda dt: self._on_pstat_done(t, V, I), 0)
+    def _on_pstat_chunk(self, V_chunk, I_chunk):
+        """Live update while the CV is still running."""
+        I_uA = to_microamps(I_chunk)
+        if I_uA.size == 0:
+            return
+        imin, imax = float(np.min(I_uA)), float(np.max(I_uA))
+        if self._live_range is not None:
+            imin, imax = min(imin, self._live_range[0]), max(imax, self._live_range[1])
+        self._live_range = (imin, imax)
+        if imin == imax: imax = imin + 1.0
+        padI = 0.05 * (imax - imin)
+        self.graph.graph.ymin, self.graph.graph.ymax = imin - padI, imax + padI
+        self.graph.append_points(list(V_chunk), I_uA.tolist())
 
-        threading.Thread(target=worker, daemon=True).start()
+        # provisional reading from the peak seen so far
+        conc = self._live_peak.feed(V_chunk, I_uA).conc
+        if conc is not None:
+            self.creatinine_label.text = f"[b][color=000000]Creatinine: ~{conc:.2f} mg/dL (live)[/color][/b]"
 
     def _on_pstat_error(self, msg: str):
         self.status_label.text = f"[b][color=000000]Status:[/color][/b] [b][color=cc0000]Error[/color][/b]"
@@ -173,33 +231,20 @@ class CreatConnectUI(BoxLayout):
         g.xmin, g.xmax = vmin, vmax
         g.ymin, g.ymax = imin - padI, imax + padI
 
-    def _on_pstat_done(self, t, V, I):
-        # Ensure numpy arrays
-        V = np.asarray(V, dtype=float)
-        I = np.asarray(I, dtype=float)
-
-        # Units: many APIs return Amps. Convert to µA if values are small.
-        if np.nanmax(np.abs(I)) < 1e-3:
-            I_uA = I * 1e6
-        else:
-            I_uA = I  # already in µA
+    def _on_pstat_done(self, result, source="potentiostat"):
+        # result comes from MeasurementScheduler: arrays already in V / µA, peak analysed
+        V, I_uA = result["V"], result["I_uA"]
+        conc_mg_dL = result["conc"]
 
         # Plot entire curve (V vs I)
         try:
             self._autoscale_graph(V, I_uA)
-            self.graph.update_graph(V.tolist(), I_uA.tolist())
+            # the graph decimates to screen resolution but always draws the peak
+            keep = [result["peak_idx"]] if result.get("peak_idx") is not None else []
+            self.graph.update_graph(V, I_uA, keep=keep)
         except Exception as e:
             print("Plotting error:", e)
 
-        # === Peak → concentration via your calibration (use REDUCTION peak) ===
-        conc_mg_dL, Ip_uA, Vp_mV, peak_idx = concentration_from_cv(
-            V, I_uA, self._cal, smooth_k=5, peak="reduction"
-        )  # CHANGED: unpack 4 values
-
-        if conc_mg_dL is None:
-            self._on_pstat_error("No data captured.")
-            return
-
         # Calibration debug printout (what value was used and how)
         # try:
             # dbg = self._cal.apply_debug(Ip_uA)
@@ -222,23 +267,28 @@ class CreatConnectUI(BoxLayout):
 
         self.status_label.text     = f"[b][color=000000]Status:[/color][/b] [b][color={color}]{status}[/color][/b]"
         self.creatinine_label.text = f"[b][color=000000]Creatinine: {conc_mg_dL:.2f} mg/dL[/color][/b]"
-
-        # Save to app history
-        app = App.get_running_app()
-        if not hasattr(app, "all_creatinine_readings"):
-            app.all_creatinine_readings = []
-        app.all_creatinine_readings.append(float(conc_mg_dL))
-
-        # Push updates back to Menu + History Log
+        if self._multi_device:
+            self.creatinine_label.text = (f"[b][color=000000]Device {result['device_id']} - "
+                                          f"Creatinine: {conc_mg_dL:.2f} mg/dL[/color][/b]")
+        flags = (result.get("quality") or {}).get("flags")
+        if flags:
+            # kept, but marked so a noisy or unresolved sweep is not taken at face value
+            self.status_label.text += f" [color=ff9900](check: {', '.join(flags)})[/color]"
+
+        # Save to history (run_id points at the raw sweep in the archive)
+        get_store().add(conc_mg_dL, Ip_uA=result.get("Ip_uA"), Vp_mV=result.get("Vp_mV"),
+                        status=status, calibration_id=result.get("calibration_id"),
+                        run_id=result.get("run_id"), device_id=result.get("device_id"),
+                        source=source)
+
+        # Push updates back to Menu (the History Log follows the store itself)
         Clock.schedule_once(self._trigger_menu_status_update, 0.05)
-        Clock.schedule_once(self._update_history_log, 0.10)
 
-        # (Optional) Save a snapshot of the graph
+        # (Optional) Save a snapshot of the graph; encoded and written off the UI thread
         try:
-            import os, datetime
-            os.makedirs("history_logs", exist_ok=True)
+            import datetime
             ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            self.graph.export_to_png(f"history_logs/CV_{ts}.png")
+            save_snapshot(f"history_logs/CV_{ts}.png", widget=self.graph, series=(V, I_uA))
         except Exception as e:
             print("Could not export graph image:", e)
 
@@ -285,12 +335,8 @@ class CreatConnectUI(BoxLayout):
         self.status_label.text = f"[b][color=000000]Status:[/color][/b] [b][color={color}]{status}[/color][/b]"
 
         # Save reading to history
-        app = App.get_running_app()
-        if app is not None:
-            if not hasattr(app, 'all_creatinine_readings'):
-                app.all_creatinine_readings = []
-            app.all_creatinine_readings.append(creatinine_val)
-            print("✅ Sensor reading complete and graph updated.")
+        get_store().add(creatinine_val, status=status, source="simulation")
+        print("✅ Sensor reading complete and graph updated.")
 
     def _finalize_sensor_reading(self):
         peak_value = max(self.readings)
@@ -309,15 +355,8 @@ class CreatConnectUI(BoxLayout):
         self.status_label.text = f"[b][color=000000]Status:[/color][/b] [b][color={color}]{status}[/color][/b]"
 
         # Save data for syncing - append to existing readings
-        app = App.get_running_app()
-        if not hasattr(app, 'all_creatinine_readings'):
-            app.all_creatinine_readings = []
-        app.all_creatinine_readings.append(peak_value)
-        
-        # Debug print to verify readings are being accumulated
+        get_store().add(peak_value, status=status, source="simulation")
         print(f"✅ _finalize_sensor_reading - Added reading: {peak_value:.2f} mg/dL")
-        print(f"✅ _finalize_sensor_reading - Total readings in history: {len(app.all_creatinine_readings)}")
-        print(f"✅ _finalize_sensor_reading - All readings: {app.all_creatinine_readings}")
 
         def delayed_screen_switch(dt):
             print("✅ Reading completed - staying on current screen")
@@ -361,24 +400,17 @@ class CreatConnectUI(BoxLayout):
 
         # Save graph image
         filename = f"{app.simulated_file}_graph.png"
-        self.graph.export_to_png(f"history_logs/{filename}")
+        save_snapshot(f"history_logs/{filename}", widget=self.graph,
+                      series=(self.timestamps, self.readings))
 
         # Store final value - append to existing readings
-        if not hasattr(app, 'all_creatinine_readings'):
-            app.all_creatinine_readings = []
-        app.all_creatinine_readings.append(peak_val)
-        
-        # Debug print to verify readings are being accumulated
+        get_store().add(peak_val, status=status, source="simulation")
         print(f"✅ Added reading: {peak_val:.2f} mg/dL")
-        print(f"✅ Total readings in history: {len(app.all_creatinine_readings)}")
-        print(f"✅ All readings: {app.all_creatinine_readings}")
 
         def switch_and_update(dt):
             print("✅ Reading completed - staying on current screen")
-            # Update menu status and history log without switching screens
+            # Update menu status without switching screens
             Clock.schedule_once(self._trigger_menu_status_update, 0.2)
-            # Update history log if it exists
-            Clock.schedule_once(self._update_history_log, 0.3)
 
         Clock.schedule_once(switch_and_update, 0.5) 
 
@@ -399,25 +431,3 @@ class CreatConnectUI(BoxLayout):
                 print("❌ menu_screen.children is empty or missing")
         else:
             print("❌ Could not access ScreenManager")
-
-    def _update_history_log(self, dt):
-        """Update history log screen with new reading"""
-        app = App.get_running_app()
-        sm = app.root
-
-        if sm and hasattr(sm, 'get_screen'):
-            try:
-                history_screen = sm.get_screen('history_log_screen')
-                if hasattr(history_screen, 'children') and len(history_screen.children) > 0:
-                    history_widget = history_screen.children[0]
-                    if hasattr(history_widget, 'load_history'):
-                        print("✅ Updating history log with new reading")
-                        history_widget.load_history()
-                    else:
-                        print("❌ history_widget has no method load_history")
-                else:
-                    print("❌ history_screen.children is empty or missing")
-            except Exception as e:
-                print(f"❌ Error updating history log: {e}")
-        else:
-            print("❌ Could not access ScreenManager")
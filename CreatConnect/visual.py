@@ -175,6 +175,8 @@ class MenuPopup(Popup):
                                font_name=HANDWRITTEN_FONT, font_size='16sp')
             if opt == "View Visuals":
                 btn.bind(on_release=self.switch_to_visual_screen)
+            elif opt == "Detailed History Graph":
+                btn.bind(on_release=self.show_history_graph)
             layout.add_widget(btn)
         self.content = layout
         self.size_hint = (None, None)
@@ -215,6 +217,55 @@ class MenuPopup(Popup):
         else:
             print("Error: Could not access ScreenManager to switch screen.")
 
+    def show_history_graph(self, instance):
+        self.dismiss()
+        HistoryTrendPopup().open()
+
+
+# --- Long-range trend from the store's hour / day / week rollups ---
+class HistoryTrendPopup(Popup):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.title = "Detailed History"
+        self.title_font = HANDWRITTEN_FONT
+        self.title_color = SKETCH_COLOR
+        self.size_hint = (0.95, 0.8)
+
+        layout = BoxLayout(orientation='vertical', spacing=dp(10), padding=dp(10))
+        self.graph = CreatinineGraph(size_hint=(1, 1))
+        self.info_label = Label(font_name=HANDWRITTEN_FONT, font_size='14sp', color=SKETCH_COLOR,
+                                size_hint=(1, None), height=dp(30))
+        close_btn = Button(text="Close", size_hint=(1, None), height=dp(40),
+                           font_name=HANDWRITTEN_FONT, font_size='16sp')
+        close_btn.bind(on_release=self.dismiss)
+        layout.add_widget(self.graph)
+        layout.add_widget(self.info_label)
+        layout.add_widget(close_btn)
+        self.content = layout
+        self.plot_trend()
+
+    def plot_trend(self):
+        """Plot the mean per bucket; a year of data is a few hundred points at most."""
+        from data_storage import get_store
+        period, rows = get_store().trend()
+        if not rows:
+            self.info_label.text = "No history data available"
+            return
+        t0 = rows[0]["bucket"]
+        days = np.array([(r["bucket"] - t0) / 86400.0 for r in rows])
+        mean = np.array([r["mean"] for r in rows])
+        lo = min(r["min"] for r in rows)
+        hi = max(r["max"] for r in rows)
+        self.graph.graph.xlabel = "Days"
+        self.graph.graph.ylabel = "Creatinine (mg/dL)"
+        span = max(days[-1], 1.0)
+        self.graph.graph.x_ticks_major = max(1.0, float(np.ceil(span / 10.0)))   # ~10 ticks
+        self.graph.graph.y_ticks_major = 0.5
+        self.graph.set_limits(0.0, span, lo, max(hi, lo + 0.1))
+        self.graph.update_graph(days, mean, keep=[int(np.argmax(mean))])
+        total = sum(r["count"] for r in rows)
+        self.info_label.text = f"{total} readings, mean per {period} (range {lo:.2f} - {hi:.2f} mg/dL)"
+
 
 class CreatConnectUI(BoxLayout):
     def make_wrapped_label(self, text, bold=False):